@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import time
+import base64
+import random
+import shutil
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+from pathlib import Path
+import sketch
+
+# Headless benchmarks: drives Bridge under a QCoreApplication against synthetic users.
+#
+#   python bench.py                                   # 100, 1000 and 10000 documents
+#   python bench.py --sizes 100000 --root /tmp/grove-bench
+#   python bench.py --save-baseline                   # write bench-baseline.json
+#   python bench.py --check                           # exit 1 if slower than the baseline
+#
+# Timings only mean something on the machine that took them, so no baseline is checked in.
+# To vet a change, record one from main first and then check the branch against it:
+#   git checkout main && python bench.py --save-baseline
+#   git checkout my-branch && python bench.py --check
+# --check without a baseline is an error rather than a silent pass.
+#
+# Datasets are generated once per (size, seed) under --root and reused; every run starts
+# from an empty cache so cold logins really are cold. Each size is measured in its own
+# process so peak RSS belongs to that size alone.
+DEFAULT_SIZES = '100,1000,10000'
+BASELINE = Path(__file__).parent / 'bench-baseline.json'
+# Share of documents per type, and how big each kind tends to be.
+MIX = (('.md', 0.40), ('.json', 0.20), ('.sketch', 0.15), ('.secret', 0.10), ('.cards', 0.15))
+WORDS = ('moss fern acorn river stone lantern meadow willow thistle clover bramble hollow '
+         'ember drizzle orchard puddle sparrow tangle marigold pebble burrow quill').split()
+
+def words(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+def make_document(rng, ext):
+    if ext == '.md':
+        size = min(max(int(rng.lognormvariate(7.5, 1.2)), 100), 512 * 1024)
+        paragraphs, total = [], 0
+        while total < size:
+            paragraphs.append(words(rng, rng.randint(20, 120)))
+            total += len(paragraphs[-1]) + 2
+        return '# ' + words(rng, 4) + '\n\n' + '\n\n'.join(paragraphs)
+    if ext == '.json':
+        return json.dumps([{"text": words(rng, rng.randint(2, 8)), "done": rng.random() < 0.4} for _ in range(rng.randint(1, 60))])
+    if ext == '.cards':
+        return json.dumps({"cards": [{"q": words(rng, 5), "a": words(rng, 12)} for _ in range(rng.randint(5, 80))]})
+    if ext == '.secret':
+        return json.dumps({"data": base64.b64encode(rng.randbytes(rng.randint(64, 4096))).decode('ascii')})
+    strokes = []
+    for _ in range(rng.randint(1, 80)):
+        x, y, points = rng.uniform(0, 800), rng.uniform(0, 600), []
+        for _ in range(rng.randint(10, 200)):
+            x, y = x + rng.uniform(-4, 4), y + rng.uniform(-4, 4)
+            points += [round(x), round(y)]
+        strokes.append({"color": rng.choice(('#5D4037', '#8BC34A', '#03A9F4')), "size": rng.choice((2, 3, 6)), "points": points})
+    return sketch.encode({"width": 800, "height": 600, "strokes": strokes})
+
+def generate(root, user, count, seed):
+    # data/<user> with `count` documents, reused when a previous run already made it.
+    user_dir = root / 'data' / user
+    marker = user_dir / '.complete'
+    if marker.exists(): return user_dir
+    shutil.rmtree(user_dir, ignore_errors=True)
+    user_dir.mkdir(parents=True)
+    rng = random.Random(seed)
+    exts = [ext for ext, _ in MIX]
+    weights = [w for _, w in MIX]
+    now = time.time()
+    for i in range(count):
+        ext = rng.choices(exts, weights)[0]
+        path = user_dir / ('%s %05d%s' % (words(rng, 2).title(), i, ext))
+        data = make_document(rng, ext)
+        if isinstance(data, str): path.write_text(data, encoding='utf-8')
+        else: path.write_bytes(data)
+        stamp = now - rng.uniform(0, 365 * 86400)
+        os.utime(path, (stamp, stamp))
+    marker.touch()
+    return user_dir
+
+def summarize(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+    total = sum(samples)
+    return {"n": len(samples), "mean_ms": round(sum(samples) / len(samples), 3), "p50_ms": round(pick(0.5), 3),
+            "p99_ms": round(pick(0.99), 3), "max_ms": round(ordered[-1], 3), "ops_per_s": round(len(samples) * 1000 / total, 1) if total else None}
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def measure(root, user, storage, rounds):
+    # Runs in the child process: one Bridge, driven through its slots like the page would.
+    from PyQt6.QtCore import QCoreApplication, QEventLoop, QTimer
+    from bridge import Bridge, STREAM_THRESHOLD
+    from profiling import profiler
+    app = QCoreApplication(sys.argv[:1])
+    bridge = Bridge(root_dir=root, storage=storage)
+    results = {}
+
+    def wait_for(signal, trigger, accept=lambda payload: True, count=1):
+        # Milliseconds from trigger() until `count` matching emissions of signal.
+        loop, hits = QEventLoop(), []
+        def on(payload):
+            if accept(payload): hits.append(payload)
+            if len(hits) >= count: loop.quit()
+        signal.connect(on)
+        start = time.perf_counter()
+        trigger()
+        if len(hits) < count:
+            QTimer.singleShot(600000, loop.quit)
+            loop.exec()
+        elapsed = (time.perf_counter() - start) * 1000
+        signal.disconnect(on)
+        if len(hits) < count: raise RuntimeError("timed out waiting for %s" % signal)
+        return elapsed
+
+    def idle(trigger):
+        start = time.perf_counter()
+        trigger()
+        while bridge.executor.queues: app.processEvents(QEventLoop.ProcessEventsFlag.WaitForMoreEvents)
+        return (time.perf_counter() - start) * 1000
+
+    def first_page(limit=200):
+        return lambda: bridge.listFiles(json.dumps({"sort": "mtime", "desc": True, "limit": limit, "request": 1}))
+
+    def login():
+        # Until the grid has its first page, which is what the user waits for.
+        return wait_for(bridge.loginSuccess, lambda: bridge.handleLogin(user, 'bench')) + wait_for(bridge.filesPage, first_page())
+
+    def forget_cache():
+        bridge.flushIndex()
+        bridge.executor.wait()
+        shutil.rmtree(root / 'cache' / user, ignore_errors=True)
+        for suffix in ('.sqlite3', '.sqlite3-wal', '.sqlite3-shm'):
+            try: os.remove(root / 'data' / (user + suffix))
+            except OSError: pass
+
+    cold = []
+    for _ in range(rounds):
+        forget_cache()
+        cold.append(login())
+    results['login_cold'] = summarize(cold)
+    results['login_warm'] = summarize([login() for _ in range(rounds)])
+
+    def rescan():
+        bridge.store.mark_dirty()
+        return wait_for(bridge.filesPage, first_page())
+    results['refresh_page'] = summarize([rescan() for _ in range(rounds)])
+    results['refresh_full'] = summarize([wait_for(bridge.loadFiles, bridge.refreshFiles) for _ in range(rounds)])
+
+    rng = random.Random(1)
+    names = ['Bench %04d' % i for i in range(rounds * 10)]
+    bodies = [make_document(rng, '.md') for _ in names]
+    added = lambda name: lambda payload: json.loads(payload)['name'] == name + '.md'
+    results['save_new'] = summarize([wait_for(bridge.fileAdded, lambda n=n, b=b: bridge.saveFile(n, b, 'diary'), added(n))
+                                     for n, b in zip(names, bodies)])
+    edits = [b + '\n\nmore ' + words(rng, 5) for b in bodies]
+    results['save_edit'] = summarize([idle(lambda n=n, e=e: bridge.saveFile(n, e, 'diary')) for n, e in zip(names, edits)])
+    def ack(payload):
+        chunk = json.loads(payload)
+        bridge.ackChunk(chunk['stream'], chunk['seq'])
+    bridge.streamChunk.connect(ack)
+    results['load'] = summarize([wait_for(bridge.streamEnd if len(e.encode('utf-8')) > STREAM_THRESHOLD else bridge.fileLoaded,
+                                          lambda n=n: bridge.loadFile(n + '.md')) for n, e in zip(names, edits)])
+    results['delete'] = summarize([wait_for(bridge.fileRemoved, lambda n=n: bridge.deleteFile(n + '.md'), added(n)) for n in names])
+
+    burst = ['Burst %04d' % i for i in range(rounds * 20)]
+    start = time.perf_counter()
+    wait_for(bridge.fileAdded, lambda: [bridge.saveFile(n, 'burst', 'diary') for n in burst], count=len(burst))
+    elapsed = (time.perf_counter() - start) * 1000
+    results['save_burst'] = {"n": len(burst), "elapsed_ms": round(elapsed, 3), "ops_per_s": round(len(burst) * 1000 / elapsed, 1)}
+    start = time.perf_counter()
+    wait_for(bridge.fileRemoved, lambda: [bridge.deleteFile(n + '.md') for n in burst], count=len(burst))
+    elapsed = (time.perf_counter() - start) * 1000
+    results['delete_burst'] = {"n": len(burst), "elapsed_ms": round(elapsed, 3), "ops_per_s": round(len(burst) * 1000 / elapsed, 1)}
+
+    bridge.shutdown()
+    report = {"ops": results, "peak_rss_mb": peak_rss_mb()}
+    if profiler.enabled: report['profile'] = profiler.report()
+    return report
+
+def compare(current, baseline, tolerance):
+    # p50 latencies (and burst throughput) against the baseline; small absolute changes
+    # are noise and never count as regressions.
+    regressions = []
+    for size, result in current['results'].items():
+        base = baseline.get('results', {}).get(size)
+        if not base: continue
+        for op, stats in result['ops'].items():
+            old = base['ops'].get(op)
+            if not old: continue
+            if 'p50_ms' in stats: new_value, old_value, worse = stats['p50_ms'], old['p50_ms'], stats['p50_ms'] - old['p50_ms']
+            else: new_value, old_value, worse = stats['elapsed_ms'], old['elapsed_ms'], stats['elapsed_ms'] - old['elapsed_ms']
+            ratio = new_value / old_value if old_value else 1
+            flag = ratio > 1 + tolerance and worse > 1
+            print('  %7s %-14s %10.2f ms -> %10.2f ms  %+6.0f%%%s' % (size, op, old_value, new_value, (ratio - 1) * 100, '  REGRESSION' if flag else ''))
+            if flag: regressions.append((size, op))
+        old_rss = base.get('peak_rss_mb')
+        if old_rss and result['peak_rss_mb'] > old_rss * (1 + tolerance):
+            print('  %7s %-14s %10.1f MB -> %10.1f MB  REGRESSION' % (size, 'peak_rss', old_rss, result['peak_rss_mb']))
+            regressions.append((size, 'peak_rss'))
+    return regressions
+
+def print_table(results):
+    for size, result in results.items():
+        print('%s documents, peak RSS %.1f MB' % (size, result['peak_rss_mb']))
+        for op, s in result['ops'].items():
+            if 'p50_ms' in s: print('  %-14s n=%-4d p50 %9.2f ms  p99 %9.2f ms  %9.1f ops/s' % (op, s['n'], s['p50_ms'], s['p99_ms'], s['ops_per_s']))
+            else: print('  %-14s n=%-4d total %7.2f ms  %9.1f ops/s' % (op, s['n'], s['elapsed_ms'], s['ops_per_s']))
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless Bridge benchmarks against synthetic collections.")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="comma-separated document counts")
+    parser.add_argument('--storage', default='files', choices=('files', 'sqlite'))
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--root', help="where datasets live between runs (default: a temp dir)")
+    parser.add_argument('--out', help="also write this run's results to a file")
+    parser.add_argument('--baseline', default=str(BASELINE))
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the baseline")
+    parser.add_argument('--check', action='store_true', help="exit 1 when a result regressed past --tolerance")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--profile', action='store_true', help="include the profiling report per size")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    root = Path(args.root) if args.root else Path(tempfile.gettempdir()) / 'grove-bench'
+    if args.check and not args.save_baseline and not Path(args.baseline).exists():
+        parser.error("no baseline at %s to check against; record one with --save-baseline first" % args.baseline)
+    if args.child:
+        print(json.dumps(measure(root, 'bench%d' % args.child, args.storage, args.rounds)))
+        return 0
+
+    results = {}
+    for size in [int(s) for s in args.sizes.split(',') if s]:
+        started = time.perf_counter()
+        generate(root, 'bench%d' % size, size, args.seed + size)
+        print('dataset of %d ready in %.1fs' % (size, time.perf_counter() - started), file=sys.stderr)
+        env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+        if args.profile: env['GROVE_PROFILE'] = '1'
+        child = subprocess.run([sys.executable, __file__, '--child', str(size), '--storage', args.storage, '--rounds', str(args.rounds),
+                                '--root', str(root)], env=env, stdout=subprocess.PIPE, check=True, text=True)
+        results[str(size)] = json.loads(child.stdout.strip().splitlines()[-1])
+    run = {"meta": {"time": time.time(), "python": platform.python_version(), "platform": platform.platform(),
+                    "cpus": os.cpu_count(), "storage": args.storage, "rounds": args.rounds, "seed": args.seed},
+           "results": results}
+    print_table(results)
+    if args.out: Path(args.out).write_text(json.dumps(run, indent=1), encoding='utf-8')
+    baseline_path = Path(args.baseline)
+    status = 0
+    if baseline_path.exists() and not args.save_baseline:
+        print('compared with %s:' % baseline_path)
+        regressions = compare(run, json.loads(baseline_path.read_text(encoding='utf-8')), args.tolerance)
+        if regressions and args.check: status = 1
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(run, indent=1), encoding='utf-8')
+        print('baseline written to %s' % baseline_path)
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
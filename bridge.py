@@ -0,0 +1,496 @@
+import sys
+import os
+import time
+import base64
+import traceback
+from collections import deque
+from pathlib import Path
+from PyQt6.QtCore import QCoreApplication, QObject, pyqtSlot, pyqtSignal, pyqtProperty, QFileSystemWatcher, QTimer, QRunnable, QThreadPool
+from storage import FileStore, Upload, atomic_write, file_type, check_login, document_name, open_store, read_chunks
+from previews import PreviewCache
+from revisions import open_revisions
+from profiling import profiler, timed, dumps, loads, TimedSignal
+
+def get_base_path():
+    if getattr(sys, 'frozen', False):
+        return Path(sys.executable).parent
+    return Path(__file__).parent
+
+SAVE_WINDOW_MS = 750
+# Edits to notes and task lists land in the revision log right away; the documents
+# themselves are rewritten at most this often.
+CHECKPOINT_MS = 2000
+PROFILE_INTERVAL_MS = int(float(os.environ.get('GROVE_PROFILE_INTERVAL', '5')) * 1000)
+# Documents bigger than STREAM_THRESHOLD bytes (and every sketch) go to the page as a
+# stream of STREAM_CHUNK pieces, with at most STREAM_WINDOW of them unacknowledged.
+STREAM_THRESHOLD = 256 * 1024
+STREAM_CHUNK = 64 * 1024
+STREAM_WINDOW = 4
+STORAGE = os.environ.get('GROVE_STORAGE', 'files')
+
+def as_deltas(updates):
+    return [(kind, dumps(entry)) for kind, entry in updates if kind]
+
+class Download:
+    def __init__(self, sid, chunks):
+        self.sid = sid
+        self.chunks = chunks
+        self.sent = 0
+        self.acked = 0
+        self.reading = False
+
+class TaskSignals(QObject):
+    done = pyqtSignal(int, object, object)
+
+class Task(QRunnable):
+    def __init__(self, rid, fn, args, label):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.rid, self.fn, self.args, self.label = rid, fn, args, label
+        self.signals = TaskSignals()
+
+    def run(self):
+        start = time.perf_counter()
+        try: result, error = self.fn(*self.args), None
+        except Exception as e: result, error = None, e
+        if profiler.enabled: profiler.record('task.' + self.label, (time.perf_counter() - start) * 1000)
+        self.signals.done.emit(self.rid, result, error)
+
+class Executor(QObject):
+    # Runs blocking work on a thread pool and hands results back on the GUI thread.
+    # Tasks sharing a key run one at a time in submission order, so everything
+    # touching one file stays ordered. Results from an older generation (a previous
+    # session), or from a "latest" task that has since been superseded, are dropped.
+    # Queued tasks of an older generation are dropped too, unless submitted with
+    # keep=True: writes still have to reach the disk after the session is gone.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.next_id = 0
+        self.generation = 0
+        self.queues = {}
+        self.latest = {}
+        self.running = {}
+
+    def submit(self, key, fn, *args, callback=None, latest=False, keep=False):
+        self.next_id += 1
+        rid = self.next_id
+        if latest: self.latest[key] = rid
+        queue = self.queues.setdefault(key, deque())
+        queue.append((rid, fn, args, callback, self.generation, latest, keep))
+        if len(queue) == 1: self.start(key)
+        return rid
+
+    def start(self, key):
+        queue = self.queues[key]
+        while queue:
+            rid, fn, args, callback, generation, latest, keep = queue[0]
+            if keep or (generation == self.generation and not (latest and self.latest.get(key) != rid)): break
+            queue.popleft()
+        if not queue:
+            del self.queues[key]
+            return
+        task = Task(rid, fn, args, 'document' if file_type(key) else key.split(':')[0])
+        task.signals.done.connect(self.finished)
+        self.running[rid] = (key, task)
+        self.pool.start(task)
+
+    def finished(self, rid, result, error):
+        key, task = self.running.pop(rid)
+        _, _, _, callback, generation, latest, _ = self.queues[key].popleft()
+        self.start(key)
+        if generation != self.generation or (latest and self.latest.get(key) != rid): return
+        if error is not None: traceback.print_exception(error)
+        elif callback: callback(result)
+
+    def reset(self):
+        self.generation += 1
+
+    def wait(self):
+        # A queued task only starts once the one ahead of it has reported back, so keep
+        # delivering results until every queue has drained.
+        while self.running:
+            self.pool.waitForDone()
+            QCoreApplication.sendPostedEvents()
+
+class Bridge(QObject):
+    loginSuccess = pyqtSignal(str)
+    loadFiles = pyqtSignal(str)
+    fileLoaded = pyqtSignal(str)
+    fileAdded = pyqtSignal(str)
+    fileChanged = pyqtSignal(str)
+    fileRemoved = pyqtSignal(str)
+    searchResults = pyqtSignal(str)
+    streamBegin = pyqtSignal(str)
+    streamChunk = pyqtSignal(str)
+    streamEnd = pyqtSignal(str)
+    uploadAck = pyqtSignal(str)
+    uploadDone = pyqtSignal(str)
+    revisionsListed = pyqtSignal(str)
+    revisionLoaded = pyqtSignal(str)
+    filesPage = pyqtSignal(str)
+    previewReady = pyqtSignal(str)
+    openBrowser = pyqtSignal(str)
+    profileReport = pyqtSignal(str)
+
+    def __init__(self, parent=None, root_dir=None, storage=None):
+        super().__init__()
+        self.parent = parent
+        self.root_dir = root_dir or get_base_path()
+        self.storage = storage or STORAGE
+        self.base_dir = self.root_dir / "data"
+        self.base_dir.mkdir(exist_ok=True)
+        self.users_file = self.root_dir / "users.json"
+        self.current_user = None
+        self.store = None
+        self.previews = None
+        self.revisions = None
+        self.executor = Executor(self)
+        self.downloads = {}
+        self.uploads = {}
+        self.next_stream = 0
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.onDirectoryChanged)
+        self.rescan_timer = QTimer(self)
+        self.rescan_timer.setSingleShot(True)
+        self.rescan_timer.setInterval(200)
+        self.rescan_timer.timeout.connect(self.rescanFiles)
+        self.index_timer = QTimer(self)
+        self.index_timer.setSingleShot(True)
+        self.index_timer.setInterval(2000)
+        self.index_timer.timeout.connect(self.flushIndex)
+        self.pending = {}
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(SAVE_WINDOW_MS)
+        self.save_timer.timeout.connect(self.flushSaves)
+        self.checkpoint_timer = QTimer(self)
+        self.checkpoint_timer.setSingleShot(True)
+        self.checkpoint_timer.setInterval(CHECKPOINT_MS)
+        self.checkpoint_timer.timeout.connect(self.flushRevisions)
+        if profiler.enabled:
+            # Every emit goes through a timing wrapper; the report lands in cache/profile.json
+            # and in the page's overlay every PROFILE_INTERVAL_MS.
+            for name, attr in vars(Bridge).items():
+                if isinstance(attr, pyqtSignal): setattr(self, name, TimedSignal(name, getattr(self, name)))
+            self.profile_timer = QTimer(self)
+            self.profile_timer.setInterval(PROFILE_INTERVAL_MS)
+            self.profile_timer.timeout.connect(self.dumpProfile)
+            self.profile_timer.start()
+
+    @pyqtProperty(bool, constant=True)
+    def profiling(self):
+        return profiler.enabled
+
+    @pyqtSlot(str)
+    def reportTimings(self, timings):
+        # The page batches its own measurements as {name: [ms, ...]}.
+        for name, samples in loads(timings).items():
+            for ms in samples: profiler.record('page.' + name, float(ms))
+
+    def dumpProfile(self):
+        path = self.root_dir / "cache" / "profile.json"
+        def dump():
+            report = dumps(profiler.report())
+            path.parent.mkdir(exist_ok=True)
+            atomic_write(path, report, durable=False)
+            return report
+        self.executor.submit('profile', dump, callback=self.profileReport.emit)
+
+    @pyqtSlot(str, str)
+    @timed
+    def handleLogin(self, username, password):
+        def open_session():
+            if not check_login(self.users_file, username, password): return None
+            store = open_store(self.root_dir, username, self.storage)
+            previews = PreviewCache(self.root_dir / "cache" / username / "previews")
+            return store, previews, open_revisions(self.root_dir, username, store) if isinstance(store, FileStore) else None
+        self.executor.submit('session', open_session, callback=lambda session: self.start_session(username, session), latest=True)
+
+    def start_session(self, username, session):
+        if session is None: return
+        store, self.previews, revisions = session
+        # Whatever the previous session still owes its documents is queued with keep=True,
+        # each checkpoint behind that document's last save, so reset() below can't drop it.
+        owed = set(self.pending) | set(self.revisions.pending() if self.revisions else ())
+        self.flushSaves()
+        for name in owed: self.flushRevision(name)
+        self.flushIndex()
+        for up in self.uploads.values(): self.executor.submit(up.name, up.abort, keep=True)
+        self.uploads.clear()
+        self.downloads.clear()
+        self.executor.reset()
+        self.current_user = username
+        self.store = store
+        self.revisions = revisions
+        if self.watcher.directories(): self.watcher.removePaths(self.watcher.directories())
+        if store.watch_dir: self.watcher.addPath(str(store.watch_dir))
+        self.loginSuccess.emit(username)
+
+    def onDirectoryChanged(self, path):
+        # Something touched the user's folder. Our own saves already updated the index,
+        # so only a change from outside the app is worth a rescan.
+        if self.store and self.store.changed_outside(): self.rescan_timer.start()
+
+    @pyqtSlot()
+    @timed
+    def refreshFiles(self):
+        if not self.store: return
+        store = self.store
+        self.executor.submit('list', lambda: dumps(store.list()), callback=self.loadFiles.emit, latest=True)
+
+    @pyqtSlot(str)
+    @timed
+    def listFiles(self, options):
+        # One page of the collection. options: sort ('mtime', 'name' or 'type'), desc,
+        # types (list or null), limit, and the opaque cursor from the previous page.
+        if not self.store: return
+        opts = loads(options)
+        store = self.store
+        def page():
+            result = store.page(opts.get('sort', 'mtime'), opts.get('desc', False), opts.get('types'),
+                                max(1, min(int(opts.get('limit', 100)), 1000)), opts.get('cursor'))
+            result['request'] = opts.get('request')
+            return dumps(result)
+        self.executor.submit('list', page, callback=self.filesPage.emit, latest=True)
+
+    def rescanFiles(self):
+        if not self.store: return
+        def scan(store):
+            added, changed, removed = store.scan()
+            return as_deltas([('added', e) for e in added] + [('changed', e) for e in changed] + [('removed', e) for e in removed])
+        self.executor.submit('scan', scan, self.store, callback=self.emitDeltas, latest=True)
+
+    def emitDeltas(self, deltas):
+        signals = {'added': self.fileAdded, 'changed': self.fileChanged, 'removed': self.fileRemoved}
+        for kind, payload in deltas: signals[kind].emit(payload)
+        if deltas: self.index_timer.start()
+
+    def flushIndex(self):
+        if self.store: self.executor.submit('flush', self.store.flush, keep=True)
+
+    @pyqtSlot(str)
+    @timed
+    def loadFile(self, filename):
+        if not self.store: return
+        ftype = file_type(filename)
+        if not ftype: return
+        self.flushSave(filename)
+        self.flushRevision(filename)
+        store = self.store
+        self.executor.submit(filename, lambda: as_deltas([store.revalidate(filename)]), callback=self.emitDeltas)
+        self.executor.submit(filename, self.openDocument, store, filename, ftype, callback=self.emitDocument)
+
+    def openDocument(self, store, filename, ftype):
+        # Small documents travel whole in a single fileLoaded. Sketches and anything past
+        # STREAM_THRESHOLD are opened here and read lazily, one chunk per task.
+        try:
+            if ftype == 'sketch':
+                header, chunks = store.open_sketch(filename)
+                return {"name": filename, "type": ftype, "header": header}, (base64.b64encode(c).decode('ascii') for c in chunks)
+            entry = store.get(filename)
+            if entry and entry['size'] > STREAM_THRESHOLD:
+                return {"name": filename, "type": ftype}, read_chunks(store.open_text(filename), STREAM_CHUNK)
+            return dumps({"name": filename, "type": ftype, "content": store.read(filename)}), None
+        except (OSError, ValueError): return None
+
+    def emitDocument(self, result):
+        if result is None: return
+        payload, chunks = result
+        if chunks is None:
+            self.fileLoaded.emit(payload)
+            return
+        self.next_stream += 1
+        download = self.downloads[self.next_stream] = Download(self.next_stream, chunks)
+        payload['stream'] = download.sid
+        self.streamBegin.emit(dumps(payload))
+        self.pumpDownload(download)
+
+    def pumpDownload(self, download):
+        # Read the next chunk unless one is already being read or the page is a full
+        # window behind; every ackChunk from the page lets another one through.
+        if download.reading or download.sent - download.acked >= STREAM_WINDOW: return
+        download.reading = True
+        self.executor.submit('stream:%d' % download.sid, next, download.chunks, None,
+                             callback=lambda data: self.emitChunk(download, data))
+
+    def emitChunk(self, download, data):
+        download.reading = False
+        if self.downloads.get(download.sid) is not download: return
+        if data is None:
+            del self.downloads[download.sid]
+            self.streamEnd.emit(dumps({"stream": download.sid, "seq": download.sent}))
+            return
+        download.sent += 1
+        self.streamChunk.emit(dumps({"stream": download.sid, "seq": download.sent, "data": data}))
+        self.pumpDownload(download)
+
+    @pyqtSlot(int, int)
+    @timed
+    def ackChunk(self, sid, seq):
+        download = self.downloads.get(sid)
+        if not download: return
+        download.acked = max(download.acked, seq)
+        self.pumpDownload(download)
+
+    @pyqtSlot(int)
+    @timed
+    def cancelStream(self, sid):
+        download = self.downloads.pop(sid, None)
+        if download: self.executor.submit('stream:%d' % sid, download.chunks.close)
+
+    @pyqtSlot(str, str, str)
+    @timed
+    def beginUpload(self, uid, name, ftype):
+        # The page's side of streaming: chunks numbered from 1, each acknowledged with
+        # uploadAck once it is on disk, then endUpload to swap the document in.
+        # A newer upload of the same document supersedes one still in flight.
+        name = self.targetName(name, ftype)
+        if not name: return
+        self.pending.pop(name, None)
+        for old_uid, up in list(self.uploads.items()):
+            if up.name != name: continue
+            del self.uploads[old_uid]
+            self.executor.submit(up.name, up.abort, keep=True)
+            self.uploadDone.emit(dumps({"upload": old_uid, "name": name, "ok": False, "superseded": True}))
+        self.uploads[uid] = Upload(self.store, name)
+
+    @pyqtSlot(str, int, str)
+    @timed
+    def uploadChunk(self, uid, seq, data):
+        up = self.uploads.get(uid)
+        if not up: return
+        self.executor.submit(up.name, up.write, seq, data,
+                             callback=lambda _: self.uploadAck.emit(dumps({"upload": uid, "seq": seq})))
+
+    @pyqtSlot(str)
+    @timed
+    def endUpload(self, uid):
+        up = self.uploads.pop(uid, None)
+        if not up: return
+        def done(deltas):
+            self.emitDeltas(deltas)
+            self.uploadDone.emit(dumps({"upload": uid, "name": up.name, "ok": up.error is None}))
+        revisions = self.revisions
+        def commit():
+            deltas = as_deltas([up.commit()])
+            if revisions: revisions.sync(up.name)
+            return deltas
+        self.executor.submit(up.name, commit, callback=done, keep=True)
+
+    @pyqtSlot(str, int)
+    @timed
+    def search(self, query, limit):
+        if not self.store: return
+        store = self.store
+        self.executor.submit('search', lambda: dumps({"query": query, "results": store.search(query, limit)}),
+                             callback=self.searchResults.emit, latest=True)
+
+    @pyqtSlot(str)
+    @timed
+    def requestPreviews(self, names):
+        # Previews come from the cache when the document's mtime still matches and are
+        # otherwise built in the background, streaming back one previewReady each.
+        if not self.store: return
+        self.executor.submit('previews', self.buildPreviews, self.store, self.previews, loads(names), self.executor.generation)
+
+    def buildPreviews(self, store, cache, names, generation):
+        for name in names:
+            if generation != self.executor.generation: return
+            entry = store.get(name)
+            if not entry: continue
+            # A document that can't be previewed just goes without, whatever is wrong with it.
+            try: preview = cache.preview(store, entry)
+            except Exception: continue
+            self.previewReady.emit(dumps({"name": name, "mtime_ns": entry['mtime_ns'], "preview": preview}))
+
+    def targetName(self, name, ftype):
+        return document_name(name, ftype) if self.store else None
+
+    def queueSave(self, name, content, ftype):
+        name = self.targetName(name, ftype)
+        if name: self.pending[name] = content
+        return name
+
+    @pyqtSlot(str, str, str)
+    @timed
+    def saveFile(self, name, content, ftype):
+        name = self.queueSave(name, content, ftype)
+        if name: self.flushSave(name)
+
+    @pyqtSlot(str, str, str)
+    @timed
+    def autosave(self, name, content, ftype):
+        # Cheap enough to call on every keystroke: repeated saves of a document
+        # within SAVE_WINDOW_MS collapse into a single write.
+        if self.queueSave(name, content, ftype) and not self.save_timer.isActive(): self.save_timer.start()
+
+    @pyqtSlot()
+    @timed
+    def flushSaves(self):
+        for name in list(self.pending): self.flushSave(name)
+
+    def flushSave(self, name):
+        content = self.pending.pop(name, None)
+        if content is None or not self.store: return
+        store, revisions = self.store, self.revisions
+        def save():
+            # Notes and task lists that already exist only append the edit to their log.
+            if revisions and revisions.record(name, content): return None
+            return as_deltas([store.write(name, content)])
+        self.executor.submit(name, save, callback=self.saved, keep=True)
+
+    def saved(self, deltas):
+        if deltas is None:
+            if not self.checkpoint_timer.isActive(): self.checkpoint_timer.start()
+        else: self.emitDeltas(deltas)
+
+    def flushRevisions(self):
+        if self.revisions:
+            for name in self.revisions.pending(): self.flushRevision(name)
+
+    def flushRevision(self, name):
+        if not self.revisions: return
+        revisions = self.revisions
+        self.executor.submit(name, lambda: as_deltas([revisions.reconcile(name)]), callback=self.emitDeltas, keep=True)
+
+    @pyqtSlot(str)
+    @timed
+    def listRevisions(self, filename):
+        if not self.store: return
+        revisions = self.revisions
+        self.executor.submit(filename, lambda: dumps({"name": filename, "revisions": revisions.history(filename) if revisions else []}),
+                             callback=self.revisionsListed.emit)
+
+    @pyqtSlot(str, int)
+    @timed
+    def loadRevision(self, filename, rev):
+        if not self.revisions: return
+        revisions = self.revisions
+        def load():
+            try: return dumps({"name": filename, "rev": rev, "content": revisions.checkout(filename, rev)})
+            except (KeyError, OSError, ValueError): return None
+        self.executor.submit(filename, load, callback=lambda payload: payload and self.revisionLoaded.emit(payload))
+
+    @pyqtSlot(str)
+    @timed
+    def deleteFile(self, filename):
+        if not self.store: return
+        self.pending.pop(filename, None)
+        store, revisions = self.store, self.revisions
+        def delete():
+            if revisions: revisions.remove(filename)
+            return as_deltas([store.delete(filename)])
+        self.executor.submit(filename, delete, callback=self.emitDeltas, keep=True)
+
+    def shutdown(self):
+        self.flushSaves()
+        self.executor.wait()
+        if self.revisions:
+            for name in self.revisions.pending(): self.revisions.checkpoint(name)
+        if self.store: self.store.flush()
+
+    @pyqtSlot(str)
+    @timed
+    def launchExplorer(self, url):
+        self.openBrowser.emit(url)
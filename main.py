@@ -1,99 +1,56 @@
 import sys
 import os
-import json
-from pathlib import Path
 from PyQt6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget, QPushButton, QHBoxLayout, QLineEdit
 from PyQt6.QtWebEngineWidgets import QWebEngineView
+from PyQt6.QtWebEngineCore import QWebEngineUrlScheme, QWebEngineUrlSchemeHandler, QWebEngineUrlRequestJob, QWebEngineProfile, QWebEnginePage
 from PyQt6.QtWebChannel import QWebChannel
-from PyQt6.QtCore import QObject, pyqtSlot, pyqtSignal, Qt, QUrl
-
-def get_base_path():
-    if getattr(sys, 'frozen', False):
-        return Path(sys.executable).parent
-    return Path(__file__).parent
-
-class Bridge(QObject):
-    loginSuccess = pyqtSignal(str)
-    loadFiles = pyqtSignal(str)
-    openBrowser = pyqtSignal(str)
-
-    def __init__(self, parent):
-        super().__init__()
-        self.parent = parent
-        self.root_dir = get_base_path()
-        self.base_dir = self.root_dir / "data"
-        self.base_dir.mkdir(exist_ok=True)
-        self.users_file = self.root_dir / "users.json"
-        self.current_user = None
-
-    @pyqtSlot(str, str)
-    def handleLogin(self, username, password):
-        users = {}
-        if self.users_file.exists():
-            with open(self.users_file, 'r') as f:
-                try: users = json.load(f)
-                except: users = {}
-        if username in users:
-            if users[username] == password: self.start_session(username)
-        else:
-            users[username] = password
-            with open(self.users_file, 'w') as f: json.dump(users, f)
-            self.start_session(username)
-
-    def start_session(self, username):
-        self.current_user = username
-        (self.base_dir / username).mkdir(exist_ok=True)
-        self.loginSuccess.emit(username)
-        self.refreshFiles()
-
-    @pyqtSlot()
-    def refreshFiles(self):
-        if not self.current_user: return
-        user_dir = self.base_dir / self.current_user
-        files = []
-        ext_map = {'.md': 'diary', '.json': 'tasks', '.sketch': 'sketch', '.secret': 'secret', '.cards': 'flashcards'}
-        for f in user_dir.glob("*"):
-            ftype = ext_map.get(f.suffix)
-            if not ftype: continue
-            try:
-                with open(f, 'r', encoding='utf-8') as file:
-                    if f.suffix in ['.json', '.sketch', '.secret', '.cards']:
-                        content = json.load(file)
-                    else:
-                        content = file.read()
-                files.append({"id": str(f.name), "name": f.name, "content": content, "type": ftype})
-            except: continue
-        self.loadFiles.emit(json.dumps(files))
-
-    @pyqtSlot(str, str, str)
-    def saveFile(self, name, content, ftype):
-        if not self.current_user: return
-        exts = {"diary": ".md", "tasks": ".json", "sketch": ".sketch", "secret": ".secret", "flashcards": ".cards"}
-        ext = exts.get(ftype, ".txt")
-        if not name.strip(): name = "Untitled"
-        if not name.endswith(ext): name += ext
-        
-        path = self.base_dir / self.current_user / name
-        try:
-            data = json.loads(content)
-            with open(path, 'w', encoding='utf-8') as f:
-                json.dump(data, f)
-        except:
-            with open(path, 'w', encoding='utf-8') as f:
-                f.write(content)
-        
-        self.refreshFiles()
-
-    @pyqtSlot(str)
-    def deleteFile(self, filename):
-        if not self.current_user: return
-        path = self.base_dir / self.current_user / filename
-        if path.exists(): os.remove(path)
-        self.refreshFiles()
-
-    @pyqtSlot(str)
-    def launchExplorer(self, url):
-        self.openBrowser.emit(url)
+from PyQt6.QtCore import Qt, QUrl, QTimer, QBuffer, QIODevice
+import bridge
+from bridge import Bridge, get_base_path
+from storage import migrate
+from profiling import profiler
+
+SCHEME = b"grove"
+EXPLORER_CACHE_BYTES = 200 * 1024 * 1024
+# Seconds a hidden Explorer stays frozen before its renderer is discarded. 0 keeps it
+# frozen indefinitely but still honours Chromium's memory-pressure hint; -1 never discards.
+EXPLORER_DISCARD_AFTER = int(os.environ.get('GROVE_EXPLORER_DISCARD_AFTER', '300'))
+MIME_TYPES = {'.html': b'text/html', '.css': b'text/css', '.js': b'text/javascript', '.svg': b'image/svg+xml',
+              '.png': b'image/png', '.woff2': b'font/woff2'}
+
+def register_scheme():
+    # Must run before the QApplication exists.
+    scheme = QWebEngineUrlScheme(SCHEME)
+    scheme.setSyntax(QWebEngineUrlScheme.Syntax.Host)
+    scheme.setFlags(QWebEngineUrlScheme.Flag.SecureScheme | QWebEngineUrlScheme.Flag.LocalScheme |
+                    QWebEngineUrlScheme.Flag.LocalAccessAllowed)
+    QWebEngineUrlScheme.registerScheme(scheme)
+
+class AssetHandler(QWebEngineUrlSchemeHandler):
+    # Serves the bundled page from web/ as grove://app/..., keeping each file in
+    # memory after its first read so reloads (e.g. Sign Out) never touch the disk.
+    def __init__(self, root, parent=None):
+        super().__init__(parent)
+        self.root = root.resolve()
+        self.cache = {}
+
+    def requestStarted(self, job):
+        path = job.requestUrl().path().lstrip('/') or 'index.html'
+        data = self.cache.get(path)
+        if data is None:
+            target = (self.root / path).resolve()
+            if self.root not in target.parents:
+                job.fail(QWebEngineUrlRequestJob.Error.RequestDenied)
+                return
+            try: data = target.read_bytes()
+            except OSError:
+                job.fail(QWebEngineUrlRequestJob.Error.UrlNotFound)
+                return
+            self.cache[path] = data
+        buf = QBuffer(job)
+        buf.setData(data)
+        buf.open(QIODevice.OpenModeFlag.ReadOnly)
+        job.reply(MIME_TYPES.get(os.path.splitext(path)[1], b'application/octet-stream'), buf)
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -106,6 +63,26 @@ class MainWindow(QMainWindow):
         self.channel = QWebChannel()
         self.channel.registerObject('pybridge', self.bridge)
 
+        # The Explorer is built on first use; see ensure_explorer.
+        self.explorer_container = None
+        self.explorer_profile = None
+        self.explorer_url = None
+        self.discard_timer = QTimer(self)
+        self.discard_timer.setSingleShot(True)
+        self.discard_timer.timeout.connect(self.discard_explorer)
+
+        self.main_view = QWebEngineView()
+        self.main_view.page().setWebChannel(self.channel)
+        self.setCentralWidget(self.main_view)
+
+        self.bridge.openBrowser.connect(self.show_explorer)
+
+        self.assets = AssetHandler(get_base_path() / "web", self)
+        self.main_view.page().profile().installUrlSchemeHandler(SCHEME, self.assets)
+        self.main_view.setUrl(QUrl(SCHEME.decode() + "://app/index.html"))
+
+    def ensure_explorer(self):
+        if self.explorer_container is not None: return
         self.explorer_container = QWidget(self)
         self.explorer_container.hide()
         self.explorer_layout = QVBoxLayout(self.explorer_container)
@@ -124,288 +101,73 @@ class MainWindow(QMainWindow):
         toolbar.addStretch()
         self.explorer_layout.addLayout(toolbar)
 
+        # A named profile keeps its HTTP cache and site storage on disk, so even a
+        # discarded or restarted Explorer comes back warm.
+        cache_dir = get_base_path() / "cache" / "explorer"
+        self.explorer_profile = QWebEngineProfile("explorer", self)
+        self.explorer_profile.setCachePath(str(cache_dir / "http"))
+        self.explorer_profile.setPersistentStoragePath(str(cache_dir / "storage"))
+        self.explorer_profile.setHttpCacheType(QWebEngineProfile.HttpCacheType.DiskHttpCache)
+        self.explorer_profile.setHttpCacheMaximumSize(EXPLORER_CACHE_BYTES)
+
         self.explorer_view = QWebEngineView()
+        self.explorer_view.setPage(QWebEnginePage(self.explorer_profile, self.explorer_view))
         self.explorer_view.setStyleSheet("border-radius: 20px; background: white;")
         self.explorer_view.urlChanged.connect(self.handle_url_change)
+        self.explorer_view.page().recommendedStateChanged.connect(self.handle_recommended_state)
         self.explorer_layout.addWidget(self.explorer_view)
 
-        self.main_view = QWebEngineView()
-        self.main_view.page().setWebChannel(self.channel)
-        self.setCentralWidget(self.main_view)
-
-        self.bridge.openBrowser.connect(self.show_explorer)
-
-        self.html_content = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <script src="https://cdn.tailwindcss.com"></script>
-            <script src="https://unpkg.com/lucide@latest"></script>
-            <script src="qrc:///qtwebchannel/qwebchannel.js"></script>
-            <style>
-                @import url('https://fonts.googleapis.com/css2?family=Nunito:wght@400;700&family=Gaegu:wght@400;700&display=swap');
-                :root { --grass: #88B04B; --bark: #6D4C41; --leaf-light: #C5E1A5; }
-                
-                * { cursor: none !important; }
-                
-                body { 
-                    transition: background-color 5s ease; 
-                    font-family: 'Nunito', sans-serif; 
-                    height: 100vh; 
-                    overflow: hidden; 
-                    margin: 0; 
-                    position: relative;
-                }
-                
-                .theme-day { background-color: #E3F2FD; }
-                .theme-sunset { background-color: #FFCCBC; }
-                .theme-night { background-color: #263238; color: white; }
-
-                /* Scenery Styles */
-                .scenery-layer {
-                    position: fixed;
-                    bottom: 0;
-                    left: 0;
-                    width: 100%;
-                    height: 100%;
-                    pointer-events: none;
-                    z-index: 0;
-                }
-
-                .tree {
-                    position: absolute;
-                    bottom: 0;
-                    width: 60px;
-                    height: 100px;
-                    background: var(--bark);
-                    border-radius: 10px 10px 0 0;
-                }
-                .tree::after {
-                    content: '';
-                    position: absolute;
-                    top: -60px;
-                    left: -40px;
-                    width: 140px;
-                    height: 100px;
-                    background: var(--grass);
-                    border-radius: 50% 50% 50% 50%;
-                    box-shadow: 0 5px 15px rgba(0,0,0,0.1);
-                }
-
-                .cloud {
-                    position: absolute;
-                    background: white;
-                    border-radius: 50px;
-                    opacity: 0.8;
-                    animation: float linear infinite;
-                    box-shadow: 0 10px 20px rgba(0,0,0,0.05);
-                }
-                .cloud::after, .cloud::before {
-                    content: '';
-                    position: absolute;
-                    background: inherit;
-                    border-radius: 50%;
-                }
-
-                @keyframes float {
-                    from { transform: translateX(-200px); }
-                    to { transform: translateX(100vw); }
-                }
-
-                #custom-cursor { 
-                    position: fixed; 
-                    width: 32px; 
-                    height: 32px; 
-                    pointer-events: none; 
-                    z-index: 99999; 
-                    transform: translate(-50%, -50%) rotate(-15deg); 
-                    transition: transform 0.1s ease-out; 
-                    filter: drop-shadow(2px 2px 2px rgba(0,0,0,0.1)); 
-                }
-
-                .bubble { background: white; border-radius: 2rem; box-shadow: 0 10px 0 rgba(0,0,0,0.05); border: 4px solid white; position: relative; color: var(--bark); }
-                .theme-night .bubble { background: #37474F; border-color: #455A64; color: white; }
-
-                .leaf-card { background: white; border-radius: 1.5rem 4rem; transition: all 0.3s ease; cursor: none; border: 3px solid transparent; color: var(--bark); }
-                .theme-night .leaf-card { background: #37474F; color: white; }
-                .leaf-card:hover { transform: translateY(-5px); border-color: var(--grass); }
-
-                .overlay { position: fixed; inset: 0; z-index: 5000; display: none; padding: 2rem; background: rgba(255, 255, 255, 0.95); backdrop-filter: blur(10px); }
-                .theme-night .overlay { background: rgba(38, 50, 56, 0.95); }
-                .overlay.active { display: flex; flex-direction: column; }
-                
-                .nav-pill { background: var(--grass); color: white; padding: 0.75rem 2rem; border-radius: 999px; font-weight: 700; box-shadow: 0 4px 0 #558B2F; }
-                .hide { display: none !important; }
-            </style>
-        </head>
-        <body class="flex flex-col theme-day">
-            <!-- Background Scenery -->
-            <div class="scenery-layer" id="scenery">
-                <div id="clouds-container"></div>
-                <div id="forest-container"></div>
-            </div>
-
-            <div id="custom-cursor"><svg viewBox="0 0 24 24" fill="#88B04B"><path d="M2.00002 21.9998L3.99991 19.9999C12.5 21.9998 18.5 16 19.5 9.49983C20.5 2.99983 14.5 1.99983 14.5 1.99983C14.5 1.99983 14 8.49983 7 10.4998C2.5 11.7855 2.00002 16.4998 2.00002 21.9998Z"/></svg></div>
-            
-            <div id="login" class="fixed inset-0 z-[9999] flex items-center justify-center p-10">
-                <div class="bubble p-12 text-center w-full max-w-sm space-y-6">
-                    <h1 class="text-3xl font-bold">Nature Desk</h1>
-                    <input id="u" type="text" placeholder="Your Name" class="w-full text-center p-3 rounded-xl border">
-                    <input id="p" type="password" placeholder="Passkey" class="w-full text-center p-3 rounded-xl border text-bark">
-                    <button onclick="login()" class="nav-pill w-full">Enter the Grove</button>
-                </div>
-            </div>
-
-            <div id="dashboard" class="hide h-full flex flex-col p-8 relative z-10">
-                <header class="flex justify-between items-center mb-12">
-                    <h1 class="text-4xl font-bold" id="welcome-text">Hello!</h1>
-                    <button onclick="location.reload()" class="opacity-40 font-bold">Sign Out</button>
-                </header>
-
-                <div class="flex-1 overflow-y-auto space-y-12">
-                    <section>
-                        <h2 class="text-xl font-bold mb-6 opacity-60 uppercase tracking-widest text-sm">Create New</h2>
-                        <div class="grid grid-cols-2 md:grid-cols-3 lg:grid-cols-6 gap-4">
-                            <div class="leaf-card p-6 flex flex-col items-center gap-3" onclick="newFile('diary')"><i data-lucide="feather"></i><span>Note</span></div>
-                            <div class="leaf-card p-6 flex flex-col items-center gap-3" onclick="newFile('tasks')"><i data-lucide="list-checks"></i><span>Tasks</span></div>
-                            <div class="leaf-card p-6 flex flex-col items-center gap-3" onclick="newFile('sketch')"><i data-lucide="palette"></i><span>Sketch</span></div>
-                            <div class="leaf-card p-6 flex flex-col items-center gap-3" onclick="newFile('secret')"><i data-lucide="lock"></i><span>Secret</span></div>
-                            <div class="leaf-card p-6 flex flex-col items-center gap-3" onclick="newFile('flashcards')"><i data-lucide="layers"></i><span>Cards</span></div>
-                            <div class="leaf-card p-6 flex flex-col items-center gap-3 text-blue-500" onclick="pybridge.launchExplorer('https://www.google.com')"><i data-lucide="globe"></i><span>Explorer</span></div>
-                        </div>
-                    </section>
-
-                    <section>
-                        <h2 class="text-xl font-bold mb-6 opacity-60 uppercase tracking-widest text-sm">Collection</h2>
-                        <div id="file-grid" class="grid grid-cols-2 md:grid-cols-5 gap-4"></div>
-                    </section>
-                </div>
-            </div>
-
-            <div id="app-overlay" class="overlay">
-                <div class="flex items-center gap-4 mb-8">
-                    <button onclick="closeApp()" class="w-12 h-12 rounded-full bg-white text-bark flex items-center justify-center shadow">←</button>
-                    <input id="file-title" class="text-2xl font-bold bg-transparent border-none flex-1 focus:outline-none">
-                    <button onclick="discardCurrent()" class="nav-pill !bg-red-400">Discard</button>
-                    <button onclick="triggerSave()" class="nav-pill">Save & Close</button>
-                </div>
-                <div id="ui-diary" class="flex-1 hide"><textarea id="diary-box" class="w-full h-full p-8 rounded-3xl border shadow-inner focus:outline-none text-bark"></textarea></div>
-                <div id="ui-tasks" class="flex-1 hide overflow-y-auto text-bark"><div id="task-items"></div><button onclick="addTaskRow()" class="w-full p-4 mt-4 border-2 border-dashed rounded-xl">+ Task</button></div>
-                <div id="ui-sketch" class="flex-1 hide bg-white rounded-3xl border-4 overflow-hidden"><canvas id="paint-canvas"></canvas></div>
-                <div id="ui-secret" class="flex-1 hide flex flex-col gap-4 text-bark"><textarea id="secret-plain" class="flex-1 p-4 rounded-xl border focus:outline-none" oninput="updateSecret()"></textarea><textarea id="secret-encoded" class="flex-1 p-4 rounded-xl border bg-gray-50 focus:outline-none" readonly></textarea></div>
-                <div id="ui-flashcards" class="flex-1 hide flex flex-col items-center"><div class="bubble p-20 text-3xl font-bold w-full max-w-lg text-center" id="card-q"></div></div>
-            </div>
-
-            <script>
-                let pybridge;
-                let activeType = null;
-                let currentFileName = null;
-
-                // Dynamic Lighting Cycle
-                const themes = ['day', 'sunset', 'night'];
-                let currentThemeIdx = 0;
-                setInterval(() => {
-                    currentThemeIdx = (currentThemeIdx + 1) % themes.length;
-                    document.body.className = 'flex flex-col theme-' + themes[currentThemeIdx];
-                }, 30000);
-
-                // Scenery Generation
-                function createScenery() {
-                    const forest = document.getElementById('forest-container');
-                    const clouds = document.getElementById('clouds-container');
-                    
-                    // Add Trees
-                    for(let i=0; i<8; i++) {
-                        const t = document.createElement('div');
-                        t.className = 'tree';
-                        t.style.left = (i * 15 + Math.random() * 5) + 'vw';
-                        t.style.opacity = 0.3 + Math.random() * 0.5;
-                        t.style.transform = `scale(${0.5 + Math.random()})`;
-                        forest.appendChild(t);
-                    }
-
-                    // Add Clouds
-                    for(let i=0; i<5; i++) {
-                        const c = document.createElement('div');
-                        c.className = 'cloud';
-                        c.style.width = (100 + Math.random() * 100) + 'px';
-                        c.style.height = '40px';
-                        c.style.top = (10 + Math.random() * 30) + 'vh';
-                        c.style.animationDuration = (30 + Math.random() * 60) + 's';
-                        c.style.animationDelay = -(Math.random() * 60) + 's';
-                        clouds.appendChild(c);
-                    }
-                }
-                createScenery();
-
-                new QWebChannel(qt.webChannelTransport, function(channel) {
-                    pybridge = channel.objects.pybridge;
-                    pybridge.loginSuccess.connect(user => {
-                        document.getElementById('login').classList.add('hide');
-                        document.getElementById('dashboard').classList.remove('hide');
-                        document.getElementById('welcome-text').innerText = "Hello, " + user + "!";
-                    });
-                    pybridge.loadFiles.connect(json => { renderFiles(JSON.parse(json)); });
-                });
-
-                function login() { pybridge.handleLogin(u.value, p.value); }
-                function renderFiles(files) {
-                    const grid = document.getElementById('file-grid');
-                    grid.innerHTML = '';
-                    files.forEach(f => {
-                        const card = document.createElement('div');
-                        card.className = "bubble p-4 text-center cursor-none";
-                        card.innerHTML = `<div class="font-bold">${f.name.split('.')[0]}</div><div class="text-xs opacity-40">${f.type}</div>`;
-                        card.onclick = () => openFile(f);
-                        grid.appendChild(card);
-                    });
-                }
-
-                function newFile(type) { openFile({name:'Untitled', type:type, content:''}); }
-                function openFile(file) {
-                    activeType = file.type; currentFileName = file.name;
-                    document.getElementById('app-overlay').classList.add('active');
-                    document.getElementById('file-title').value = file.name.split('.')[0];
-                    ['ui-diary', 'ui-tasks', 'ui-sketch', 'ui-secret', 'ui-flashcards'].forEach(id => document.getElementById(id).classList.add('hide'));
-                    document.getElementById('ui-' + file.type).classList.remove('hide');
-                    if(file.type === 'diary') document.getElementById('diary-box').value = file.content;
-                }
-                function triggerSave() { pybridge.saveFile(document.getElementById('file-title').value, document.getElementById('diary-box').value, activeType); closeApp(); }
-                function closeApp() { document.getElementById('app-overlay').classList.remove('active'); }
-                function discardCurrent() { if(confirm("Discard?")) { pybridge.deleteFile(currentFileName); closeApp(); } }
-
-                document.addEventListener('mousemove', e => {
-                    const c = document.getElementById('custom-cursor');
-                    c.style.left = e.clientX + 'px'; c.style.top = e.clientY + 'px';
-                });
-                lucide.createIcons();
-            </script>
-        </body>
-        </html>
-        """
-        self.main_view.setHtml(self.html_content)
-
     def handle_url_change(self, url):
         self.url_display.setText(url.toString())
 
     def show_explorer(self, url):
-        self.url_display.setText(url)
-        self.explorer_view.setUrl(QUrl(url))
+        self.ensure_explorer()
+        self.discard_timer.stop()
+        page = self.explorer_view.page()
+        page.setLifecycleState(QWebEnginePage.LifecycleState.Active)
+        # Re-opening the same destination resumes the frozen page instead of reloading it.
+        if url != self.explorer_url:
+            self.explorer_url = url
+            self.url_display.setText(url)
+            self.explorer_view.setUrl(QUrl(url))
         self.explorer_container.setGeometry(self.rect())
         self.explorer_container.show()
         self.explorer_container.raise_()
 
     def hide_explorer(self):
         self.explorer_container.hide()
-        self.explorer_view.setUrl(QUrl("about:blank"))
+        # A hidden page may be frozen (no timers, no JS) but keeps its state.
+        QTimer.singleShot(0, lambda: self.set_explorer_state(QWebEnginePage.LifecycleState.Frozen))
+        if EXPLORER_DISCARD_AFTER > 0: self.discard_timer.start(EXPLORER_DISCARD_AFTER * 1000)
+
+    def set_explorer_state(self, state):
+        if self.explorer_container is None or self.explorer_container.isVisible(): return
+        page = self.explorer_view.page()
+        if page.lifecycleState() != state: page.setLifecycleState(state)
+
+    def discard_explorer(self):
+        # Drops the renderer's memory; the next show reloads from the disk cache.
+        self.set_explorer_state(QWebEnginePage.LifecycleState.Discarded)
+
+    def handle_recommended_state(self, state):
+        # Chromium recommends Discarded under memory pressure; only follow it when allowed.
+        if state == QWebEnginePage.LifecycleState.Discarded and EXPLORER_DISCARD_AFTER < 0: return
+        if state != QWebEnginePage.LifecycleState.Active: self.set_explorer_state(state)
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
-        if hasattr(self, 'explorer_container') and self.explorer_container.isVisible():
+        if getattr(self, 'explorer_container', None) and self.explorer_container.isVisible():
             self.explorer_container.setGeometry(self.rect())
 
 if __name__ == "__main__":
+    if '--migrate' in sys.argv:
+        migrate(get_base_path() / "data")
+        sys.exit(0)
+    if '--storage' in sys.argv: bridge.STORAGE = sys.argv[sys.argv.index('--storage') + 1]
+    if '--profile' in sys.argv: profiler.enabled = True
+    register_scheme()
     app = QApplication(sys.argv)
     window = MainWindow()
+    app.aboutToQuit.connect(window.bridge.shutdown)
     window.show()
     sys.exit(app.exec())
\ No newline at end of file
@@ -0,0 +1,95 @@
+import os
+import json
+import base64
+import hashlib
+import threading
+from PyQt6.QtCore import QBuffer, QByteArray, QIODevice, QPointF, Qt
+from PyQt6.QtGui import QColor, QImage, QPainter, QPen
+from storage import atomic_write
+from sketch import parse_color
+
+THUMB_SIZE = (120, 90)
+PREVIEW_LINES = 3
+
+def render_thumbnail(content):
+    # Fit every stroke of a decoded sketch into a small PNG and return it as a data URL.
+    strokes = content.get('strokes', [])
+    xs = [x for s in strokes for x in s['points'][0::2]] or [0]
+    ys = [y for s in strokes for y in s['points'][1::2]] or [0]
+    width = content.get('width') or max(xs) or 1
+    height = content.get('height') or max(ys) or 1
+    scale = min(THUMB_SIZE[0] / width, THUMB_SIZE[1] / height)
+    image = QImage(*THUMB_SIZE, QImage.Format.Format_ARGB32)
+    image.fill(QColor('white'))
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    for s in strokes:
+        pts = s['points']
+        # Sketch colours are #RRGGBBAA, which QColor would read as #AARRGGBB.
+        rgba = parse_color(s['color'])
+        if rgba is None: rgba = 0x000000ff
+        pen = QPen(QColor(rgba >> 24, (rgba >> 16) & 0xff, (rgba >> 8) & 0xff, rgba & 0xff), max(s['size'] * scale, 1))
+        pen.setCapStyle(Qt.PenCapStyle.RoundCap)
+        painter.setPen(pen)
+        painter.drawPolyline([QPointF(pts[i] * scale, pts[i + 1] * scale) for i in range(0, len(pts) - 1, 2)])
+    painter.end()
+    data = QByteArray()
+    buf = QBuffer(data)
+    buf.open(QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buf, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(bytes(data)).decode('ascii')
+
+def build_preview(store, entry):
+    preview = dict(entry.get('summary', {}))
+    if entry['type'] == 'diary':
+        lines = [l.strip() for l in store.head(entry['name']).splitlines() if l.strip()]
+        preview['lines'] = [l[:80] for l in lines[:PREVIEW_LINES]]
+    elif entry['type'] == 'sketch':
+        preview['thumb'] = render_thumbnail(store.read_sketch(entry['name']))
+    return preview
+
+class PreviewCache:
+    # Small JSON files under cache/<user>/previews, one per (document, mtime). Reads
+    # touch the file, and once the directory grows past max_bytes the least recently
+    # used previews are deleted.
+    def __init__(self, cache_dir, max_bytes=16 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.sizes = {de.name: de.stat().st_size for de in os.scandir(cache_dir) if de.name.endswith('.json')}
+
+    def path(self, name, mtime_ns):
+        return self.cache_dir / (hashlib.sha1(('%s\0%d' % (name, mtime_ns)).encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, name, mtime_ns):
+        path = self.path(name, mtime_ns)
+        try:
+            with open(path, 'r', encoding='utf-8') as f: preview = json.load(f)
+            os.utime(path)
+            return preview
+        except (OSError, ValueError): return None
+
+    def put(self, name, mtime_ns, preview):
+        path = self.path(name, mtime_ns)
+        text = json.dumps(preview)
+        atomic_write(path, text, durable=False)
+        with self.lock:
+            self.sizes[path.name] = len(text.encode('utf-8'))
+            if sum(self.sizes.values()) > self.max_bytes: self.evict()
+
+    def evict(self):
+        by_age = sorted((de.stat().st_mtime_ns, de.name) for de in os.scandir(self.cache_dir) if de.name in self.sizes)
+        total = sum(self.sizes.values())
+        for _, fname in by_age:
+            if total <= self.max_bytes * 3 // 4: break
+            try: os.remove(self.cache_dir / fname)
+            except OSError: pass
+            total -= self.sizes.pop(fname)
+
+    def preview(self, store, entry):
+        cached = self.get(entry['name'], entry['mtime_ns'])
+        if cached is not None: return cached
+        preview = build_preview(store, entry)
+        self.put(entry['name'], entry['mtime_ns'], preview)
+        return preview
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import bisect
+import threading
+from functools import wraps
+
+# Opt-in instrumentation, switched on with GROVE_PROFILE=1 or --profile. Everything is
+# recorded into latency histograms (milliseconds) and size counters (characters of JSON
+# or bytes of file data) keyed by name:
+#   slot.<name>    time spent in a Bridge slot on the GUI thread
+#   emit.<name>    time spent emitting a signal (QWebChannel serialises it right there)
+#   task.<key>     time a background task spent running on the pool
+#   phase.<name>   glob, stat, read, json parse, json dump and emit, wherever they happen
+#   page.<name>    render timings reported back by the page
+# While disabled, the hooks cost one attribute check.
+BOUNDS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th sample (the max for the last bucket).
+        rank, seen = q * self.count, 0
+        for bound, n in zip(BOUNDS_MS, self.counts):
+            seen += n
+            if seen >= rank: return min(bound, self.max)
+        return self.max
+
+    def report(self):
+        return {"count": self.count, "mean_ms": round(self.total / self.count, 3) if self.count else 0,
+                "p50_ms": self.quantile(0.5), "p99_ms": self.quantile(0.99), "max_ms": round(self.max, 3),
+                "buckets": {("<=%g" % b if i < len(BOUNDS_MS) else ">%g" % BOUNDS_MS[-1]): n
+                            for i, (b, n) in enumerate(zip(BOUNDS_MS + (None,), self.counts)) if n}}
+
+class Phase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record('phase.' + self.name, (time.perf_counter() - self.start) * 1000)
+
+class NullPhase:
+    def __enter__(self): return self
+    def __exit__(self, *exc): pass
+
+NULL_PHASE = NullPhase()
+
+class Profiler:
+    def __init__(self):
+        self.enabled = bool(os.environ.get('GROVE_PROFILE'))
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timings = {}
+            self.sizes = {}
+            self.started = time.time()
+
+    def record(self, name, ms):
+        with self.lock:
+            hist = self.timings.get(name)
+            if hist is None: hist = self.timings[name] = Histogram()
+            hist.add(ms)
+
+    def count(self, name, size):
+        with self.lock:
+            calls, total = self.sizes.get(name, (0, 0))
+            self.sizes[name] = (calls + 1, total + size)
+
+    def phase(self, name):
+        return Phase(self, name) if self.enabled else NULL_PHASE
+
+    def report(self):
+        with self.lock:
+            return {"since": self.started, "now": time.time(),
+                    "timings": {name: hist.report() for name, hist in sorted(self.timings.items())},
+                    "sizes": {name: {"count": calls, "total": total} for name, (calls, total) in sorted(self.sizes.items())}}
+
+profiler = Profiler()
+
+def timed(fn):
+    # Goes under @pyqtSlot, so the slot keeps its signature as far as Qt is concerned.
+    name = 'slot.' + fn.__name__
+    @wraps(fn)
+    def wrapper(*args):
+        if not profiler.enabled: return fn(*args)
+        for arg in args[1:]:
+            if isinstance(arg, str): profiler.count(name, len(arg))
+        start = time.perf_counter()
+        try: return fn(*args)
+        finally: profiler.record(name, (time.perf_counter() - start) * 1000)
+    return wrapper
+
+class TimedSignal:
+    # Stands in for a bound signal on one instance: emits are timed and their payload
+    # sizes counted, everything else (connect, disconnect) goes to the real signal.
+    def __init__(self, name, signal):
+        self.name = name
+        self.signal = signal
+
+    def emit(self, *args):
+        start = time.perf_counter()
+        self.signal.emit(*args)
+        ms = (time.perf_counter() - start) * 1000
+        profiler.record('emit.' + self.name, ms)
+        profiler.record('phase.emit', ms)
+        profiler.count('emit.' + self.name, sum(len(a) for a in args if isinstance(a, str)))
+
+    def __getattr__(self, attr):
+        return getattr(self.signal, attr)
+
+def dumps(obj):
+    if not profiler.enabled: return json.dumps(obj)
+    with profiler.phase('json dump'): text = json.dumps(obj)
+    profiler.count('phase.json dump', len(text))
+    return text
+
+def loads(text):
+    if not profiler.enabled: return json.loads(text)
+    profiler.count('phase.json parse', len(text))
+    with profiler.phase('json parse'): return json.loads(text)
@@ -0,0 +1,263 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from storage import atomic_write, file_type
+
+# Revision history for notes (.md) and task lists (.json), kept in data/<user>/.grove/revs.
+# Each document gets a directory of segments: <rev>.snap holds the whole document as of
+# revision <rev>, and <rev>.log appends one JSON line per later save with just the edit:
+#   .md   {"at": i, "del": n, "ins": "text"}            (common prefix/suffix delta)
+#   .json {"op": "set"|"del"|"splice", "path": [...], ...}
+# Rebuilding a revision means loading the nearest snapshot and replaying at most
+# COMPACT_OPS lines. Once a segment grows past that, the compactor writes a fresh
+# snapshot and starts a new segment; only the newest KEEP_SEGMENTS are kept.
+COMPACT_OPS = 100
+KEEP_SEGMENTS = 20
+TRACKED = ('diary', 'tasks')
+
+def same(a, b):
+    # == that also compares types, all the way down: in JSON 1, 1.0 and true are three
+    # different values, and turning one into another is an edit like any other.
+    if type(a) is not type(b): return False
+    if isinstance(a, dict): return a.keys() == b.keys() and all(same(v, b[k]) for k, v in a.items())
+    if isinstance(a, list): return len(a) == len(b) and all(map(same, a, b))
+    return a == b
+
+def common_affixes(a, b, block=65536):
+    # Lengths of the shared prefix and suffix. Each scan walks a block at a time and then
+    # bisects inside the first block that differs, so comparisons run at memcmp speed.
+    def shared(same, limit):
+        lo = 0
+        while lo + block <= limit and same(lo, lo + block): lo += block
+        hi = min(lo + block, limit)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if same(lo, mid): lo = mid
+            else: hi = mid - 1
+        return lo
+    limit = min(len(a), len(b))
+    prefix = shared(lambda i, j: same(a[i:j], b[i:j]), limit)
+    suffix = shared(lambda i, j: same(a[len(a) - j:len(a) - i], b[len(b) - j:len(b) - i]), limit - prefix)
+    return prefix, suffix
+
+def text_ops(old, new):
+    if old == new: return []
+    prefix, suffix = common_affixes(old, new)
+    return [{"at": prefix, "del": len(old) - prefix - suffix, "ins": new[prefix:len(new) - suffix]}]
+
+def json_ops(old, new, path=()):
+    if same(old, new): return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = [{"op": "del", "path": list(path) + [k]} for k in old if k not in new]
+        for k, v in new.items():
+            ops += json_ops(old[k], v, path + (k,)) if k in old else [{"op": "set", "path": list(path) + [k], "value": v}]
+        return ops
+    if isinstance(old, list) and isinstance(new, list):
+        prefix, suffix = common_affixes(old, new)
+        removed, inserted = len(old) - prefix - suffix, new[prefix:len(new) - suffix]
+        if removed == len(inserted) == 1: return json_ops(old[prefix], inserted[0], path + (prefix,))
+        return [{"op": "splice", "path": list(path), "at": prefix, "del": removed, "ins": inserted}]
+    return [{"op": "set", "path": list(path), "value": new}]
+
+def apply_op(content, op):
+    if 'op' not in op: return content[:op['at']] + op['ins'] + content[op['at'] + op['del']:]
+    path = op['path']
+    if op['op'] == 'set' and not path: return op['value']
+    target = content
+    for key in path[:-1] if op['op'] != 'splice' else path: target = target[key]
+    if op['op'] == 'set': target[path[-1]] = op['value']
+    elif op['op'] == 'del': del target[path[-1]]
+    else: target[op['at']:op['at'] + op['del']] = op['ins']
+    return content
+
+class RevisionLog:
+    def __init__(self, path, name):
+        self.path = path
+        self.json = file_type(name) == 'tasks'
+
+    def segments(self):
+        try: return sorted(int(f[:-5]) for f in os.listdir(self.path) if f.endswith('.snap'))
+        except OSError: return []
+
+    def records(self, base):
+        # A line torn by a crash mid-append is the last one and is simply ignored.
+        try:
+            with open(self.path / ('%d.log' % base), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try: yield json.loads(line)
+                    except ValueError: return
+        except FileNotFoundError: return
+
+    def snapshot(self, base):
+        with open(self.path / ('%d.snap' % base), 'r', encoding='utf-8', newline='') as f:
+            return json.load(f) if self.json else f.read()
+
+    def checkout(self, rev=None):
+        # Content as of `rev` (the newest revision when None), as (rev, content).
+        bases = [b for b in self.segments() if rev is None or b <= rev]
+        if not bases: raise KeyError(rev)
+        base = bases[-1]
+        content = self.snapshot(base)
+        for record in self.records(base):
+            if rev is not None and record['rev'] > rev: break
+            for op in record['ops']: content = apply_op(content, op)
+            base = record['rev']
+        if rev is not None and base != rev: raise KeyError(rev)
+        return base, content
+
+    def history(self):
+        # A compacted segment's snapshot repeats the last revision of the one before it.
+        revs = {}
+        for base in self.segments():
+            try: revs.setdefault(base, os.stat(self.path / ('%d.snap' % base)).st_mtime)
+            except OSError: continue
+            revs.update((r['rev'], r['time']) for r in self.records(base))
+        return [{"rev": rev, "time": t} for rev, t in sorted(revs.items())]
+
+    def modified(self):
+        base = self.segments()[-1]
+        return max((os.stat(self.path / ('%d%s' % (base, suffix))).st_mtime_ns
+                    for suffix in ('.snap', '.log') if (self.path / ('%d%s' % (base, suffix))).exists()), default=0)
+
+    def start(self, rev, content):
+        self.path.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.path / ('%d.snap' % rev), json.dumps(content) if self.json else content)
+
+    def append(self, rev, ops):
+        base = self.segments()[-1]
+        line = json.dumps({"rev": rev, "time": time.time(), "ops": ops}) + '\n'
+        with open(self.path / ('%d.log' % base), 'a', encoding='utf-8', newline='') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        return rev - base
+
+    def compact(self, rev, content):
+        self.start(rev, content)
+        for base in self.segments()[:-KEEP_SEGMENTS]:
+            for suffix in ('.snap', '.log'):
+                try: os.remove(self.path / ('%d%s' % (base, suffix)))
+                except OSError: pass
+
+class Revisions:
+    # Saves of tracked documents append their edit to the log and update an in-memory
+    # head; the document file itself is rewritten later by checkpoint(), once per burst
+    # of edits. Everything for one name runs on that name's executor queue.
+    def __init__(self, root, store):
+        self.root = root
+        self.store = store
+        self.heads = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+    def log(self, name):
+        return RevisionLog(self.root / hashlib.sha1(name.encode('utf-8')).hexdigest()[:20], name)
+
+    def stamp(self, name):
+        try: st = os.stat(self.store.user_dir / name)
+        except OSError: return None
+        return st.st_size, st.st_mtime_ns
+
+    def head(self, name):
+        # Cached head, reloaded from the log when the file changed behind our back. If
+        # log and file disagree, whichever was written last wins: a newer file was edited
+        # outside the Grove and is logged as a revision, a newer log means we stopped
+        # before the last checkpoint and the file still has to catch up.
+        cached = self.heads.get(name)
+        if cached and (name in self.dirty or cached['stamp'] == self.stamp(name)): return cached
+        log = self.log(name)
+        try: rev, content = log.checkout()
+        except KeyError: rev, content = None, None
+        stamp = self.stamp(name)
+        if stamp:
+            current = self.store.read(name)
+            if rev is None:
+                rev = 0
+                log.start(rev, current)
+                content = current
+            elif not same(current, content) and log.modified() > stamp[1]:
+                with self.lock: self.dirty.add(name)
+            elif not same(current, content):
+                ops = text_ops(content, current) if not log.json else json_ops(content, current)
+                rev += 1
+                log.append(rev, ops)
+                content = current
+        cached = self.heads[name] = {"rev": rev, "content": content, "stamp": stamp, "ops": rev - log.segments()[-1]}
+        return cached
+
+    def record(self, name, content):
+        # Returns False when the document isn't tracked and should be written whole.
+        if file_type(name) not in TRACKED or self.stamp(name) is None: return False
+        log = self.log(name)
+        if log.json:
+            try: content = json.loads(content)
+            except ValueError: return False
+        try: head = self.head(name)
+        except (OSError, ValueError): return False
+        ops = json_ops(head['content'], content) if log.json else text_ops(head['content'], content)
+        if not ops: return True
+        head['rev'] += 1
+        head['ops'] = log.append(head['rev'], ops)
+        head['content'] = content
+        with self.lock: self.dirty.add(name)
+        return True
+
+    def sync(self, name):
+        # After the file was replaced wholesale (a streamed upload), log the difference.
+        if file_type(name) not in TRACKED or not self.stamp(name): return
+        with self.lock: self.dirty.discard(name)
+        self.heads.pop(name, None)
+        try: self.head(name)
+        except (OSError, ValueError): pass
+
+    def pending(self):
+        with self.lock: return list(self.dirty)
+
+    def checkpoint(self, name):
+        # Write the head back to the document and fold a long segment into a snapshot.
+        with self.lock:
+            if name not in self.dirty: return None, None
+            self.dirty.discard(name)
+        head = self.heads[name]
+        content = head['content']
+        update = self.store.write(name, json.dumps(content) if self.log(name).json else content)
+        head['stamp'] = self.stamp(name)
+        if head['ops'] >= COMPACT_OPS:
+            self.log(name).compact(head['rev'], content)
+            head['ops'] = 0
+        return update
+
+    def settled(self, name):
+        # Whether the file is known to match the log, so reading it needs no reconcile().
+        return file_type(name) not in TRACKED or (name in self.heads and name not in self.dirty)
+
+    def reconcile(self, name):
+        # checkpoint() for a document we may not have looked at since starting. After a
+        # crash the dirty set is empty, but head() sees the log was written after the
+        # file and marks it dirty, so the file catches up before anyone reads it.
+        if name not in self.heads and file_type(name) in TRACKED and self.log(name).segments():
+            try: self.head(name)
+            except (OSError, ValueError): pass
+        return self.checkpoint(name)
+
+    def history(self, name):
+        return self.log(name).history() if file_type(name) in TRACKED else []
+
+    def checkout(self, name, rev):
+        return self.log(name).checkout(rev)[1]
+
+    def remove(self, name):
+        with self.lock: self.dirty.discard(name)
+        self.heads.pop(name, None)
+        shutil.rmtree(self.log(name).path, ignore_errors=True)
+
+def open_revisions(root_dir, username, store):
+    # The log sits with the documents rather than in cache/: until the next checkpoint it
+    # holds the only copy of an edit. Logs from the old cache/<user>/revs are moved over.
+    path = store.staging / 'revs'
+    old = root_dir / "cache" / username / "revs"
+    if old.is_dir() and not path.exists(): shutil.move(old, path)
+    return Revisions(path, store)
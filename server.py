@@ -0,0 +1,475 @@
+import os
+import sys
+import json
+import time
+import base64
+import random
+import struct
+import sqlite3
+import asyncio
+import hashlib
+import argparse
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from storage import TYPE_EXTS, FileStore, check_login, document_name, file_type, open_store
+from revisions import open_revisions
+
+# Headless server mode: the Bridge operations (login, list, load, save, delete) over a
+# WebSocket, for several people sharing one data/ folder on a kiosk box or a LAN.
+#
+#   python server.py [--host 127.0.0.1] [--port 8765] [--storage files|sqlite] [--root DIR]
+#   python server.py --load ws://127.0.0.1:8765 --clients 32      # scripted load generator
+#   python server.py --load local --docs 2000                     # same, against a throwaway server
+#
+# Every message is JSON text. Requests carry an id and an op, replies echo the id:
+#   {"id": 1, "op": "login", "user": "ana", "password": "..."}  -> {"id": 1, "ok": true, "user": "ana"}
+#   {"id": 2, "op": "list", "sort": "mtime", "desc": true, "types": null, "limit": 100, "cursor": null}
+#   {"id": 3, "op": "load", "name": "Notes.md"}                  -> {"id": 3, "ok": true, "document": {...}}
+#   {"id": 4, "op": "save", "name": "Notes", "type": "diary", "content": "..."}
+#   {"id": 5, "op": "delete", "name": "Notes.md"}
+# Failures reply {"id", "ok": false, "error"}. Changes made by any connection are pushed
+# to every connection of the same user as {"event": "added"|"changed"|"removed", "entry"}.
+#
+# All connections of one user share a single store, index and revision log, and all users
+# share one content cache, so N clients never mean N rescans of data/. Writes for a user
+# go through that user's lock. The protocol is plain ws://, passwords included, so keep
+# it on localhost or a trusted network.
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+MAX_MESSAGE = 64 * 1024 * 1024
+CONTENT_CACHE_BYTES = 64 * 1024 * 1024
+# Files added, renamed or removed in data/<user> from outside are noticed by the next listing
+# at most RESCAN_INTERVAL late. Files edited in place leave the folder's mtime alone; those
+# are caught when loaded, and by a full stat pass every REVALIDATE_INTERVAL.
+RESCAN_INTERVAL = 2.0
+REVALIDATE_INTERVAL = 30.0
+CHECKPOINT_DELAY = 2.0
+# Change events waiting for a connection that has stopped reading; past this it is dropped.
+OUTBOX_MAX = 1000
+
+class ProtocolError(Exception):
+    def __init__(self, code, reason):
+        super().__init__(reason)
+        self.code = code
+
+def mask_bytes(data, key):
+    # XOR with the repeating 4-byte key, done as one big-integer operation.
+    n = len(data)
+    pad = int.from_bytes((key * (n // 4 + 1))[:n], 'big')
+    return (int.from_bytes(data, 'big') ^ pad).to_bytes(n, 'big')
+
+def frame(opcode, data, masked=False):
+    n = len(data)
+    bit = 0x80 if masked else 0
+    head = bytes([0x80 | opcode])
+    if n < 126: head += bytes([bit | n])
+    elif n < 65536: head += bytes([bit | 126]) + struct.pack('!H', n)
+    else: head += bytes([bit | 127]) + struct.pack('!Q', n)
+    if not masked: return head + data
+    key = os.urandom(4)
+    return head + key + mask_bytes(data, key)
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + GUID).encode('ascii')).digest()).decode('ascii')
+
+class WebSocket:
+    # RFC 6455 on top of an asyncio stream pair. Clients mask what they send, servers
+    # don't; fragmented messages are reassembled and pings answered in recv().
+    def __init__(self, reader, writer, client=False):
+        self.reader = reader
+        self.writer = writer
+        self.client = client
+        self.send_lock = asyncio.Lock()
+        self.closed = False
+        self.outbox = None
+        self.pump = None
+
+    async def read_frame(self):
+        b0, b1 = await self.reader.readexactly(2)
+        length = b1 & 0x7f
+        if length == 126: length, = struct.unpack('!H', await self.reader.readexactly(2))
+        elif length == 127: length, = struct.unpack('!Q', await self.reader.readexactly(8))
+        if length > MAX_MESSAGE: raise ProtocolError(1009, "message too big")
+        if bool(b1 & 0x80) == self.client: raise ProtocolError(1002, "wrong masking")
+        key = await self.reader.readexactly(4) if b1 & 0x80 else None
+        data = await self.reader.readexactly(length)
+        return bool(b0 & 0x80), b0 & 0x0f, mask_bytes(data, key) if key else data
+
+    async def recv(self):
+        # The next text message, or None once the peer closed the connection.
+        parts, size = [], 0
+        while True:
+            fin, opcode, data = await self.read_frame()
+            if opcode == 0x8:
+                await self.close(1000)
+                return None
+            if opcode == 0x9:
+                await self.write(frame(0xA, data, self.client))
+                continue
+            if opcode == 0xA: continue
+            if opcode not in (0x0, 0x1, 0x2) or (opcode == 0x0) != bool(parts): raise ProtocolError(1002, "unexpected frame")
+            parts.append(data)
+            size += len(data)
+            if size > MAX_MESSAGE: raise ProtocolError(1009, "message too big")
+            if fin: return b''.join(parts).decode('utf-8')
+
+    async def write(self, data):
+        async with self.send_lock:
+            self.writer.write(data)
+            await self.writer.drain()
+
+    async def send(self, text):
+        await self.write(frame(0x1, text.encode('utf-8'), self.client))
+
+    def post(self, text):
+        # Send without waiting: messages queue in an outbox drained by a task of this
+        # connection's own, so a peer that stops reading only holds up itself. Returns
+        # False once the connection is gone or has fallen OUTBOX_MAX messages behind.
+        if self.closed: return False
+        if self.outbox is None:
+            self.outbox = asyncio.Queue()
+            self.pump = asyncio.ensure_future(self.drain_outbox())
+        if self.outbox.qsize() >= OUTBOX_MAX:
+            self.abort()
+            return False
+        self.outbox.put_nowait(text)
+        return True
+
+    async def drain_outbox(self):
+        try:
+            while True: await self.send(await self.outbox.get())
+        except (ConnectionError, RuntimeError): self.abort()
+
+    def abort(self):
+        self.closed = True
+        if self.pump: self.pump.cancel()
+        self.writer.transport.abort()
+
+    async def close(self, code=1000):
+        if self.closed: return
+        self.closed = True
+        if self.pump: self.pump.cancel()
+        try: await self.write(frame(0x8, struct.pack('!H', code), self.client))
+        except (ConnectionError, RuntimeError): pass
+        self.writer.close()
+
+async def read_headers(reader):
+    lines = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    return lines[0], {k.strip().lower(): v.strip() for k, v in (l.split(':', 1) for l in lines[1:] if ':' in l)}
+
+async def accept(reader, writer):
+    start, headers = await read_headers(reader)
+    key = headers.get('sec-websocket-key')
+    if not start.startswith('GET ') or headers.get('upgrade', '').lower() != 'websocket' or not key:
+        writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+        writer.close()
+        return None
+    writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                  'Sec-WebSocket-Accept: %s\r\n\r\n' % accept_key(key)).encode('ascii'))
+    await writer.drain()
+    return WebSocket(reader, writer)
+
+async def connect(url):
+    host, _, port = url.split('://', 1)[1].split('/', 1)[0].partition(':')
+    reader, writer = await asyncio.open_connection(host, int(port or 80), limit=MAX_MESSAGE)
+    key = base64.b64encode(os.urandom(16)).decode('ascii')
+    writer.write(('GET / HTTP/1.1\r\nHost: %s\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                  'Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n\r\n' % (host, key)).encode('ascii'))
+    status, headers = await read_headers(reader)
+    if ' 101 ' not in status or headers.get('sec-websocket-accept') != accept_key(key):
+        raise ConnectionError("handshake refused: " + status)
+    return WebSocket(reader, writer, client=True)
+
+class ContentCache:
+    # Loaded documents as ready-to-send JSON, keyed by (user, name, mtime_ns, size), evicted
+    # least recently used first once they add up to max_bytes.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        payload = self.items.get(key)
+        if payload is not None: self.items.move_to_end(key)
+        return payload
+
+    def put(self, key, payload):
+        self.discard(key)
+        self.items[key] = payload
+        self.size += len(payload)
+        while self.size > self.max_bytes and len(self.items) > 1:
+            _, old = self.items.popitem(last=False)
+            self.size -= len(old)
+
+    def discard(self, key):
+        old = self.items.pop(key, None)
+        if old is not None: self.size -= len(old)
+
+    def forget(self, user, name):
+        for key in [k for k in self.items if k[0] == user and k[1] == name]: self.discard(key)
+
+class UserState:
+    def __init__(self, name, store, revisions):
+        self.name = name
+        self.store = store
+        self.revisions = revisions
+        self.lock = asyncio.Lock()
+        self.clients = set()
+        self.scanned = 0.0
+        self.revalidated = time.monotonic()
+        self.checkpoint = None
+
+def valid_name(name):
+    return isinstance(name, str) and name.strip() and not name.startswith('.') and not any(c in name for c in '/\\\0')
+
+class Server:
+    def __init__(self, root_dir, storage='files'):
+        self.root_dir = root_dir
+        (root_dir / "data").mkdir(parents=True, exist_ok=True)
+        self.users_file = root_dir / "users.json"
+        self.storage = storage
+        self.users = {}
+        self.login_lock = asyncio.Lock()
+        self.cache = ContentCache(CONTENT_CACHE_BYTES)
+        self.pool = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4))
+        self.ops = {'login': self.login, 'list': self.list, 'load': self.load, 'save': self.save, 'delete': self.delete}
+
+    def run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+
+    async def handle(self, reader, writer):
+        try: ws = await accept(reader, writer)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError): return
+        if not ws: return
+        session = {"ws": ws, "user": None}
+        try:
+            while True:
+                text = await ws.recv()
+                if text is None: break
+                await ws.send(await self.dispatch(session, text))
+        except ProtocolError as e: await ws.close(e.code)
+        except (asyncio.IncompleteReadError, ConnectionError, UnicodeDecodeError): pass
+        finally:
+            if session['user']: session['user'].clients.discard(ws)
+            await ws.close()
+
+    async def dispatch(self, session, text):
+        rid = None
+        try:
+            request = json.loads(text)
+            if not isinstance(request, dict): raise ValueError("a request must be a JSON object")
+            rid = request.get('id')
+            op = self.ops.get(request.get('op'))
+            if op is None: raise ValueError("unknown op %r" % request.get('op'))
+            if op != self.login and not session['user']: raise PermissionError("log in first")
+            result = await op(session, request)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError, PermissionError, RecursionError, sqlite3.Error) as e:
+            return json.dumps({"id": rid, "ok": False, "error": str(e) or type(e).__name__})
+        # A cached document is already JSON, so replies are spliced together rather than re-encoded.
+        return '{"id": %s, "ok": true, %s}' % (json.dumps(rid), result)
+
+    def broadcast(self, state, updates):
+        # Never awaits, so it can't be held up by a slow client; ones that fell too far
+        # behind are dropped.
+        for kind, entry in updates:
+            if not kind: continue
+            message = json.dumps({"event": kind, "entry": entry})
+            for ws in list(state.clients):
+                if not ws.post(message): state.clients.discard(ws)
+
+    async def login(self, session, request):
+        user, password = request.get('user'), request.get('password', '')
+        if not valid_name(user): raise ValueError("invalid user name")
+        async with self.login_lock:
+            if not await self.run(check_login, self.users_file, user, password): raise PermissionError("wrong password")
+            state = self.users.get(user)
+            if state is None:
+                store = await self.run(open_store, self.root_dir, user, self.storage)
+                revisions = open_revisions(self.root_dir, user, store) if isinstance(store, FileStore) else None
+                state = self.users[user] = UserState(user, store, revisions)
+        if session['user']: session['user'].clients.discard(session['ws'])
+        session['user'] = state
+        state.clients.add(session['ws'])
+        return '"user": %s' % json.dumps(user)
+
+    async def list(self, session, request):
+        state = session['user']
+        now = time.monotonic()
+        if now - state.scanned > RESCAN_INTERVAL:
+            # Marks the index dirty only if something other than our own writes touched the folder.
+            state.store.changed_outside()
+            state.scanned = now
+        if now - state.revalidated > REVALIDATE_INTERVAL:
+            state.store.mark_dirty()
+            state.revalidated = now
+        page = await self.run(state.store.page, request.get('sort', 'mtime'), bool(request.get('desc')), request.get('types'),
+                              max(1, min(int(request.get('limit', 100)), 1000)), request.get('cursor'))
+        return json.dumps(page)[1:-1]
+
+    async def load(self, session, request):
+        state, name = session['user'], request.get('name')
+        if not valid_name(name) or not file_type(name): raise ValueError("invalid document name")
+        if state.revisions and not state.revisions.settled(name):
+            async with state.lock: update = await self.run(state.revisions.reconcile, name)
+            self.broadcast(state, [update])
+        kind, entry = update = await self.run(state.store.revalidate, name)
+        if kind: self.broadcast(state, [update])
+        if entry is None or kind == 'removed': raise FileNotFoundError("no such document: " + name)
+        key = (state.name, name, entry['mtime_ns'], entry['size'])
+        payload = self.cache.get(key)
+        if payload is None:
+            payload = await self.run(self.read, state.store, name, entry['type'])
+            self.cache.put(key, payload)
+        return '"document": ' + payload
+
+    def read(self, store, name, ftype):
+        # Sketches go out like the desktop streams them: the header plus the base64 stroke records.
+        if ftype == 'sketch':
+            header, chunks = store.open_sketch(name)
+            return json.dumps({"name": name, "type": ftype, "header": header, "data": base64.b64encode(b''.join(chunks)).decode('ascii')})
+        return json.dumps({"name": name, "type": ftype, "content": store.read(name)})
+
+    async def save(self, session, request):
+        state = session['user']
+        if request.get('type') not in TYPE_EXTS: raise ValueError("unknown document type %r" % request.get('type'))
+        name = document_name(request.get('name', ''), request.get('type'))
+        content = request.get('content')
+        if not valid_name(name) or not isinstance(content, str): raise ValueError("invalid document")
+        def write():
+            # Existing notes and task lists only append to their revision log, as on the desktop.
+            if state.revisions and state.revisions.record(name, content): return None
+            return state.store.write(name, content)
+        async with state.lock:
+            update = await self.run(write)
+            self.cache.forget(state.name, name)
+        if update is None: self.schedule_checkpoint(state)
+        else: self.broadcast(state, [update])
+        return '"name": %s' % json.dumps(name)
+
+    async def delete(self, session, request):
+        state, name = session['user'], request.get('name')
+        if not valid_name(name) or not file_type(name): raise ValueError("invalid document name")
+        def remove():
+            if state.revisions: state.revisions.remove(name)
+            return state.store.delete(name)
+        async with state.lock:
+            update = await self.run(remove)
+            self.cache.forget(state.name, name)
+        self.broadcast(state, [update])
+        return '"name": %s' % json.dumps(name)
+
+    def schedule_checkpoint(self, state):
+        if state.checkpoint is None:
+            state.checkpoint = asyncio.get_running_loop().call_later(CHECKPOINT_DELAY, lambda: asyncio.ensure_future(self.checkpoint(state)))
+
+    async def checkpoint(self, state):
+        state.checkpoint = None
+        updates = []
+        async with state.lock:
+            if state.revisions:
+                for name in state.revisions.pending(): updates.append(await self.run(state.revisions.checkpoint, name))
+            await self.run(state.store.flush)
+        self.broadcast(state, updates)
+
+    async def close(self):
+        for state in self.users.values():
+            if state.checkpoint: state.checkpoint.cancel()
+            await self.checkpoint(state)
+        self.pool.shutdown()
+
+async def serve(host, port, root_dir, storage, ready=None):
+    server = Server(root_dir, storage)
+    listener = await asyncio.start_server(server.handle, host, port, limit=MAX_MESSAGE)
+    address = listener.sockets[0].getsockname()
+    if ready: ready.set_result(address[1])
+    else: print("Grove server on ws://%s:%d" % address[:2], file=sys.stderr)
+    try:
+        async with listener: await listener.serve_forever()
+    finally: await server.close()
+
+class LoadClient:
+    # One scripted user session: requests wait for their reply, events are counted.
+    def __init__(self, ws):
+        self.ws = ws
+        self.next_id = 0
+        self.events = 0
+
+    async def call(self, op, **args):
+        self.next_id += 1
+        await self.ws.send(json.dumps(dict(args, id=self.next_id, op=op)))
+        while True:
+            message = json.loads(await self.ws.recv())
+            if 'event' in message: self.events += 1
+            elif message.get('id') == self.next_id: return message
+
+async def run_client(url, user, requests, seed, stats):
+    rng = random.Random(seed)
+    client = LoadClient(await connect(url))
+    await client.call('login', user=user, password='load')
+    names, mine = [], []
+    for i in range(requests):
+        roll = rng.random()
+        if roll < 0.35 or not names: op, args = 'list', {"sort": rng.choice(('mtime', 'name', 'type')), "desc": True, "limit": 100}
+        elif roll < 0.7: op, args = 'load', {"name": rng.choice(names)}
+        elif roll < 0.9 or not mine:
+            op, args = 'save', {"name": mine[-1] if mine and rng.random() < 0.5 else 'Load %d-%d' % (seed, i), "type": "diary",
+                                "content": '# load test\n\n' + ' '.join(rng.choice('moss fern acorn river stone'.split()) for _ in range(rng.randint(50, 2000)))}
+        else: op, args = 'delete', {"name": mine.pop(rng.randrange(len(mine)))}
+        start = time.perf_counter()
+        reply = await client.call(op, **args)
+        stats.setdefault(op, []).append((time.perf_counter() - start) * 1000)
+        if not reply['ok']: stats.setdefault('errors', []).append(reply['error'])
+        elif op == 'list': names = [e['name'] for e in reply['entries']] or names
+        elif op == 'save' and reply['name'] not in mine: mine.append(reply['name'])
+    await client.ws.close()
+    return client.events
+
+async def load_test(url, clients, users, requests, docs, storage):
+    server = None
+    if url == 'local':
+        from bench import generate
+        root = Path(tempfile.mkdtemp(prefix='grove-server-'))
+        for u in range(users): generate(root, 'load%d' % u, docs, u)
+        ready = asyncio.get_running_loop().create_future()
+        server = asyncio.ensure_future(serve('127.0.0.1', 0, root, storage, ready))
+        url = 'ws://127.0.0.1:%d' % await ready
+    stats = {}
+    start = time.perf_counter()
+    events = await asyncio.gather(*(run_client(url, 'load%d' % (c % users), requests, c, stats) for c in range(clients)))
+    elapsed = time.perf_counter() - start
+    if server: server.cancel()
+    total = sum(len(v) for k, v in stats.items() if k != 'errors')
+    print('%d clients x %d requests over %d users: %.1f requests/s, %d change events delivered'
+          % (clients, requests, users, total / elapsed, sum(events)))
+    for op, samples in sorted(stats.items()):
+        if op == 'errors': continue
+        ordered = sorted(samples)
+        pick = lambda q: ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+        print('  %-7s n=%-6d p50 %8.2f ms  p99 %8.2f ms  max %8.2f ms' % (op, len(ordered), pick(0.5), pick(0.99), ordered[-1]))
+    if stats.get('errors'): print('  errors: %d (first: %s)' % (len(stats['errors']), stats['errors'][0]))
+    if server:
+        try: await server
+        except asyncio.CancelledError: pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Grove's documents over WebSocket.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--storage', default=os.environ.get('GROVE_STORAGE', 'files'), choices=('files', 'sqlite'))
+    parser.add_argument('--root', help="folder holding data/, cache/ and users.json (default: next to this file)")
+    parser.add_argument('--load', metavar='URL', help="run the load generator against URL, or 'local' for a throwaway server")
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200, help="requests per client")
+    parser.add_argument('--docs', type=int, default=1000, help="documents per user for --load local")
+    args = parser.parse_args()
+    if args.load:
+        asyncio.run(load_test(args.load, args.clients, args.users, args.requests, args.docs, args.storage))
+        return
+    root = Path(args.root) if args.root else Path(__file__).parent
+    try: asyncio.run(serve(args.host, args.port, root, args.storage))
+    except KeyboardInterrupt: pass
+
+if __name__ == '__main__':
+    main()
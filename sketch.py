@@ -0,0 +1,124 @@
+import io
+import sys
+import json
+import struct
+from array import array
+from itertools import accumulate
+
+# Binary .sketch layout (all little-endian):
+#   b'GSKB' magic, u8 version, u32 header length, JSON header {"width", "height", "scale", "strokes"}
+#   then per stroke: u32 RGBA colour, f32 brush size, u32 point count n, u8 bytes per delta (1, 2 or 4),
+#   i32 x and y of the first point, followed by the n-1 x deltas and then the n-1 y deltas from
+#   each point to the next. Coordinates are multiplied by `scale` and rounded.
+# The page decodes strokes itself with typed arrays, so Python never has to touch the points
+# of a sketch it is only passing through.
+MAGIC = b'GSKB'
+VERSION = 1
+STROKE = struct.Struct('<IfIBii')
+WIDTHS = {1: 'b', 2: 'h', 4: 'i'}
+SWAP = sys.byteorder == 'big'
+NAMED_COLORS = {'black': '000000', 'white': 'ffffff', 'gray': '808080', 'grey': '808080', 'silver': 'c0c0c0',
+                'red': 'ff0000', 'maroon': '800000', 'orange': 'ffa500', 'yellow': 'ffff00', 'olive': '808000',
+                'lime': '00ff00', 'green': '008000', 'aqua': '00ffff', 'teal': '008080', 'blue': '0000ff',
+                'navy': '000080', 'fuchsia': 'ff00ff', 'purple': '800080', 'brown': 'a52a2a', 'transparent': '00000000'}
+
+def is_binary(data):
+    return data[:4] == MAGIC
+
+def parse_color(color):
+    # '#rgb', '#rgba', '#rrggbb', '#rrggbbaa' or a basic CSS colour name -> RGBA, None otherwise.
+    if not isinstance(color, str): return None
+    value = color.strip().lower()
+    value = NAMED_COLORS[value] if value in NAMED_COLORS else value[1:] if value.startswith('#') else ''
+    if len(value) in (3, 4): value = ''.join(c * 2 for c in value)
+    if len(value) == 6: value += 'ff'
+    if len(value) != 8 or value.strip('0123456789abcdef'): return None
+    return int(value, 16)
+
+def format_color(value):
+    return '#%06x' % (value >> 8) if value & 0xff == 0xff else '#%08x' % value
+
+def flat_points(points):
+    # Accept [x, y, x, y, ...] as well as [[x, y], ...] and [{"x", "y"}, ...].
+    if points and isinstance(points[0], (list, tuple)): return [c for p in points for c in p[:2]]
+    if points and isinstance(points[0], dict): return [c for p in points for c in (p.get('x', 0), p.get('y', 0))]
+    return points
+
+def encode(content):
+    # JSON sketch (as older versions of the Grove stored it) -> binary.
+    if isinstance(content, list): content = {"strokes": content}
+    if not isinstance(content, dict): content = {}
+    strokes = [s for s in content.get('strokes', []) if isinstance(s, dict)]
+    coords = [flat_points(s.get('points', [])) for s in strokes]
+    scale = 1 if all(float(c).is_integer() for pts in coords for c in pts) else 10
+    header = json.dumps({"width": content.get('width'), "height": content.get('height'),
+                         "scale": scale, "strokes": len(strokes)}).encode('utf-8')
+    out = bytearray(MAGIC + bytes([VERSION]) + struct.pack('<I', len(header)) + header)
+    for stroke, pts in zip(strokes, coords):
+        n = len(pts) // 2
+        origin, values = [0, 0], array('i')
+        for i, axis in enumerate((pts[0:2 * n:2], pts[1:2 * n:2])):
+            q = [round(c * scale) for c in axis]
+            if q: origin[i] = q[0]
+            values.extend(b - a for a, b in zip(q, q[1:]))
+        low, high = min(values, default=0), max(values, default=0)
+        width = 1 if -128 <= low and high <= 127 else 2 if -32768 <= low and high <= 32767 else 4
+        if width < 4: values = array(WIDTHS[width], values)
+        if SWAP: values.byteswap()
+        color = parse_color(stroke.get('color', '#000000'))
+        out += STROKE.pack(0x000000ff if color is None else color, float(stroke.get('size', 3)), n, width, *origin)
+        out += values.tobytes()
+    return bytes(out)
+
+def read_header(f):
+    if f.read(4) != MAGIC: raise ValueError("not a binary sketch")
+    version = f.read(1)[0]
+    if version != VERSION: raise ValueError("unsupported sketch version %d" % version)
+    size, = struct.unpack('<I', f.read(4))
+    return json.loads(f.read(size))
+
+def iter_chunks(f, header, chunk_bytes=65536):
+    # Raw stroke records grouped into chunks of roughly chunk_bytes, never splitting a stroke.
+    chunk = bytearray()
+    for _ in range(header['strokes']):
+        record = f.read(STROKE.size)
+        n, width = STROKE.unpack(record)[2:4]
+        chunk += record + f.read(2 * max(n - 1, 0) * width)
+        if len(chunk) >= chunk_bytes:
+            yield bytes(chunk)
+            chunk = bytearray()
+    if chunk: yield bytes(chunk)
+
+def iter_strokes(f, header):
+    scale = header.get('scale', 1)
+    for _ in range(header['strokes']):
+        color, size, n, width, x, y = STROKE.unpack(f.read(STROKE.size))
+        m = max(n - 1, 0)
+        values = array(WIDTHS[width])
+        values.frombytes(f.read(2 * m * width))
+        if SWAP: values.byteswap()
+        points = [c for xy in zip(accumulate(values[:m], initial=x), accumulate(values[m:], initial=y)) for c in xy] if n else []
+        if scale != 1: points = [c / scale for c in points]
+        yield {"color": format_color(color), "size": round(size, 2), "points": points}
+
+def decode(f):
+    header = read_header(f)
+    return {"width": header.get('width'), "height": header.get('height'), "strokes": list(iter_strokes(f, header))}
+
+def lossless(content, data):
+    # Whether `data`, the binary form of a JSON sketch, holds everything the JSON did:
+    # no unknown colours or extra fields, and no coordinates rounded by the scale.
+    if isinstance(content, list): content = {"strokes": content}
+    if not isinstance(content, dict) or set(content) - {'strokes', 'width', 'height'}: return False
+    strokes = content.get('strokes', [])
+    decoded = decode(io.BytesIO(data))['strokes']
+    if not isinstance(strokes, list) or len(strokes) != len(decoded): return False
+    for old, new in zip(strokes, decoded):
+        if set(old) - {'color', 'size', 'points'}: return False
+        color = parse_color(old.get('color', '#000000'))
+        if color is None or color != parse_color(new['color']): return False
+        if not isinstance(old.get('size', 3), (int, float)) or old.get('size', 3) != new['size']: return False
+        points = old.get('points', [])
+        if any(isinstance(p, (list, tuple, dict)) and len(p) != 2 for p in points): return False
+        if len(flat_points(points)) % 2 or flat_points(points) != new['points']: return False
+    return True
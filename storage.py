@@ -0,0 +1,626 @@
+import io
+import os
+import json
+import base64
+import sqlite3
+import bisect
+import threading
+import time
+import itertools
+from collections import deque
+import sketch
+from profiling import profiler, dumps, loads
+
+EXT_MAP = {'.md': 'diary', '.json': 'tasks', '.sketch': 'sketch', '.secret': 'secret', '.cards': 'flashcards'}
+TYPE_EXTS = {ftype: ext for ext, ftype in EXT_MAP.items()}
+JSON_EXTS = ['.json', '.sketch', '.secret', '.cards']
+INDEX_VERSION = 1
+UPLOAD_IDS = itertools.count(1)
+
+def file_type(name):
+    return EXT_MAP.get(os.path.splitext(name)[1])
+
+def document_name(name, ftype):
+    ext = TYPE_EXTS.get(ftype, ".txt")
+    if not name.strip(): name = "Untitled"
+    if not name.endswith(ext): name += ext
+    return name
+
+def read_document(path):
+    binary = path.suffix == '.sketch'
+    with profiler.phase('read'), open(path, 'rb' if binary else 'r', encoding=None if binary else 'utf-8') as file: data = file.read()
+    if profiler.enabled: profiler.count('phase.read', len(data))
+    return parse_document(path.name, data)
+
+def sketch_data(data):
+    # Stored sketch bytes, upgrading the older JSON form on the fly.
+    if isinstance(data, str): data = data.encode('utf-8')
+    if sketch.is_binary(data): return data
+    return sketch.encode(json.loads(data))
+
+def decode_sketch(data):
+    # Stored sketch bytes in either form -> {"width", "height", "strokes"} as sketch.decode gives it.
+    return sketch.decode(io.BytesIO(sketch_data(data)))
+
+def encode_document(name, content):
+    # Page content -> stored form. Sketches arrive base64-encoded in the binary
+    # format (JSON is still accepted); other JSON types are normalised.
+    ext = os.path.splitext(name)[1]
+    if ext == '.sketch':
+        if content.lstrip()[:1] in ('{', '['): return sketch.encode(json.loads(content))
+        data = base64.b64decode(content, validate=True)
+        if not sketch.is_binary(data): raise ValueError("not a sketch")
+        return data
+    if ext in JSON_EXTS:
+        try: return dumps(loads(content))
+        except ValueError: pass
+    return content
+
+def summarize_data(name, data):
+    ftype = file_type(name)
+    if isinstance(data, bytes) and sketch.is_binary(data):
+        return {"strokes": sketch.read_header(io.BytesIO(data))['strokes']}
+    return summarize(ftype, parse_document(name, data))
+
+def atomic_write(path, text, durable=True):
+    # Write to a sibling temp file, fsync it and rename it over the target, so a
+    # crash leaves either the old document or the new one, never a truncated one.
+    # Caches that can be rebuilt pass durable=False and skip the fsyncs.
+    tmp = path.with_name('.' + path.name + '.tmp')
+    if isinstance(text, str): text = text.encode('utf-8')
+    with open(tmp, 'wb') as f:
+        f.write(text)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    if durable: fsync_dir(path.parent)
+
+def fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
+    except OSError: pass
+
+def check_login(users_file, username, password):
+    # Unknown names are registered on first login, as the Grove always has.
+    users = {}
+    if users_file.exists():
+        with open(users_file, 'r') as f:
+            try: users = json.load(f)
+            except: users = {}
+    if username in users: return users[username] == password
+    users[username] = password
+    with open(users_file, 'w') as f: json.dump(users, f)
+    return True
+
+def summarize(ftype, content):
+    # Small, cheap facts about a document that the grid can show without loading it.
+    if ftype == 'diary':
+        line = next((l.strip() for l in content.splitlines() if l.strip()), '')
+        return {"title": line[:80]}
+    items = content
+    if isinstance(content, dict):
+        items = next((content[k] for k in ('items', 'cards', 'strokes') if isinstance(content.get(k), list)), [])
+    if not isinstance(items, list): items = []
+    if ftype == 'tasks':
+        done = sum(1 for t in items if isinstance(t, dict) and (t.get('done') or t.get('checked')))
+        return {"items": len(items), "done": done}
+    if ftype == 'flashcards': return {"cards": len(items)}
+    if ftype == 'sketch': return {"strokes": len(items)}
+    return {}
+
+def parse_document(name, data):
+    if isinstance(data, bytes):
+        if sketch.is_binary(data): return sketch.decode(io.BytesIO(data))
+        data = data.decode('utf-8')
+    if os.path.splitext(name)[1] in JSON_EXTS: return loads(data)
+    return data
+
+def searchable_text(ftype, content):
+    # Diary text, task items and flashcard fields. Secrets and sketches are never indexed.
+    if ftype == 'diary': return content
+    if ftype not in ('tasks', 'flashcards'): return ''
+    parts = []
+    def walk(value):
+        if isinstance(value, str): parts.append(value)
+        elif isinstance(value, dict): [walk(v) for v in value.values()]
+        elif isinstance(value, list): [walk(v) for v in value]
+    walk(content)
+    return '\n'.join(parts)
+
+def make_snippet(text, terms, width=60):
+    low = text.lower()
+    hits = [i for i in (low.find(t) for t in terms) if i >= 0]
+    if not hits: return None
+    start = max(0, min(hits) - width // 2)
+    snippet = text[start:start + width]
+    for t in terms:
+        i = snippet.lower().find(t)
+        if i >= 0: snippet = snippet[:i] + MARK_START + snippet[i:i + len(t)] + MARK_END + snippet[i + len(t):]
+    return ('…' if start else '') + snippet.replace('\n', ' ') + ('…' if start + width < len(text) else '')
+
+SORT_KEYS = {
+    'mtime': lambda e: (e['mtime_ns'], e['name']),
+    'name': lambda e: (e['name'],),
+    'type': lambda e: (e['type'], e['name']),
+}
+SORT_COLUMNS = {'mtime': ('mtime_ns', 'name'), 'name': ('name',), 'type': ('type', 'name')}
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode('ascii'))))
+
+# Snippet highlight markers; the page escapes the snippet and then turns these into <mark>.
+MARK_START, MARK_END = '\x02', '\x03'
+
+class FileStore:
+    # Loose files in data/<user>, fronted by an on-disk manifest so that only
+    # files whose (size, mtime_ns) changed since the last scan are ever opened.
+    def __init__(self, user_dir, index_path):
+        self.user_dir = user_dir
+        self.watch_dir = user_dir
+        # Temp files and uploads are written in a hidden subfolder, so the watched folder
+        # only changes when a finished document is renamed into it (see move_in).
+        self.staging = user_dir / '.grove'
+        self.staging.mkdir(exist_ok=True)
+        self.own_stamps = deque(maxlen=64)
+        self.stamp_lock = threading.Lock()
+        self.index_path = index_path
+        self.entries = {}
+        self.dirty = True
+        self.unsaved = False
+        self.version = 0
+        self.orders = {}
+        self.lock = threading.RLock()
+        self.load_index()
+
+    def load_index(self):
+        try:
+            with profiler.phase('read'), open(self.index_path, 'r', encoding='utf-8') as f: text = f.read()
+            data = loads(text)
+            if data.get('version') == INDEX_VERSION: self.entries = data['entries']
+        except: self.entries = {}
+
+    def save_index(self):
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.index_path, dumps({"version": INDEX_VERSION, "entries": self.entries}))
+        self.unsaved = False
+
+    def flush(self):
+        with self.lock:
+            if self.unsaved: self.save_index()
+
+    def make_entry(self, name, ftype, st):
+        path = self.user_dir / name
+        try:
+            if ftype == 'sketch':
+                # Only the header of a binary sketch is needed for its summary.
+                with open(path, 'rb') as f:
+                    binary = sketch.is_binary(f.read(4))
+                    f.seek(0)
+                    summary = {"strokes": sketch.read_header(f)['strokes']} if binary else summarize_data(name, f.read())
+            else: summary = summarize(ftype, read_document(path))
+        except: summary = {}
+        return {"id": name, "name": name, "type": ftype, "size": st.st_size,
+                "mtime": st.st_mtime, "mtime_ns": st.st_mtime_ns, "summary": summary}
+
+    def scan(self):
+        with self.lock: return self._scan()
+
+    def _scan(self):
+        seen, added, changed = {}, [], []
+        stamp = self.folder_stamp()
+        with profiler.phase('glob'), os.scandir(self.user_dir) as it:
+            found = [(de, file_type(de.name)) for de in it if file_type(de.name) and de.is_file()]
+        for de, ftype in found:
+            try:
+                with profiler.phase('stat'): st = de.stat()
+            except OSError: continue
+            old = self.entries.get(de.name)
+            if old and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns:
+                seen[de.name] = old
+                continue
+            seen[de.name] = self.make_entry(de.name, ftype, st)
+            (changed if old else added).append(seen[de.name])
+        removed = [entry for name, entry in self.entries.items() if name not in seen]
+        self.entries = seen
+        self.dirty = False
+        with self.stamp_lock: self.own_stamps.append(stamp)
+        if added or changed or removed:
+            self.version += 1
+            self.save_index()
+        return added, changed, removed
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def folder_stamp(self):
+        try: return os.stat(self.user_dir).st_mtime_ns
+        except OSError: return None
+
+    def changed_outside(self):
+        # Cheap check for the watcher: True (and the index marked dirty) unless the folder
+        # is exactly as our last scan or one of our own writes left it.
+        with self.stamp_lock:
+            if not self.dirty and self.folder_stamp() in self.own_stamps: return False
+            self.dirty = True
+            return True
+
+    def move_in(self, src, name):
+        # The one place the folder changes under us. A folder stamp before the change that
+        # we didn't leave ourselves means someone else got in since, so rescan next time.
+        with self.stamp_lock:
+            before = self.folder_stamp()
+            if src: os.replace(src, self.user_dir / name)
+            else: os.remove(self.user_dir / name)
+            if before not in self.own_stamps: self.dirty = True
+            self.own_stamps.append(self.folder_stamp())
+
+    def put_file(self, name, data):
+        # atomic_write, staged in the hidden subfolder.
+        tmp = self.staging / (name + '.tmp')
+        if isinstance(data, str): data = data.encode('utf-8')
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.move_in(tmp, name)
+        fsync_dir(self.user_dir)
+
+    def list(self):
+        with self.lock:
+            if self.dirty: self._scan()
+            return list(self.entries.values())
+
+    def page(self, sort, desc, types, limit, cursor=None):
+        # Keyset pagination over the in-memory index. The sorted order for each
+        # (sort, types) pair is kept until the index changes, so paging is a bisect.
+        key_fn = SORT_KEYS[sort]
+        with self.lock:
+            if self.dirty: self._scan()
+            cache_key = (sort, tuple(sorted(types or ())))
+            version, ordered, keys = self.orders.get(cache_key, (None, None, None))
+            if version != self.version:
+                ordered = sorted((e for e in self.entries.values() if not types or e['type'] in types), key=key_fn)
+                keys = [key_fn(e) for e in ordered]
+                self.orders[cache_key] = (self.version, ordered, keys)
+        if desc:
+            end = bisect.bisect_left(keys, decode_cursor(cursor)) if cursor else len(keys)
+            entries = ordered[max(0, end - limit):end][::-1]
+            more = end - limit > 0
+        else:
+            start = bisect.bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+            entries = ordered[start:start + limit]
+            more = start + limit < len(keys)
+        return {"entries": entries, "total": len(keys), "next": encode_cursor(key_fn(entries[-1])) if more and entries else None}
+
+    def update(self, name):
+        # Revalidate a single entry after we wrote or removed it ourselves. The
+        # manifest is only marked unsaved here; callers batch it up with flush().
+        with self.lock: return self._update(name)
+
+    def _update(self, name):
+        ftype = file_type(name)
+        if not ftype: return None, None
+        old = self.entries.get(name)
+        try:
+            with profiler.phase('stat'): st = os.stat(self.user_dir / name)
+        except OSError:
+            if old is None: return None, None
+            del self.entries[name]
+            self.version += 1
+            self.unsaved = True
+            return 'removed', old
+        if old and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns: return None, old
+        self.entries[name] = self.make_entry(name, ftype, st)
+        self.version += 1
+        self.unsaved = True
+        return ('changed' if old else 'added'), self.entries[name]
+
+    def revalidate(self, name):
+        # Stat one entry again before it is opened: a file edited in place leaves the
+        # folder's mtime alone, so neither the watcher nor changed_outside() sees it.
+        return self.update(name)
+
+    def get(self, name):
+        with self.lock: return self.entries.get(name)
+
+    def read(self, name):
+        return read_document(self.user_dir / name)
+
+    def head(self, name, size=4096):
+        with profiler.phase('read'), open(self.user_dir / name, 'r', encoding='utf-8', errors='ignore') as f: return f.read(size)
+
+    def search(self, query, limit):
+        # Without the SQLite engine there is no full-text index, so this is a plain scan.
+        terms = [t.lower() for t in query.split()]
+        if not terms: return []
+        results = []
+        for entry in self.list():
+            try: text = searchable_text(entry['type'], self.read(entry['name']))
+            except (OSError, ValueError): continue
+            if not all(t in text.lower() for t in terms): continue
+            results.append({"name": entry['name'], "type": entry['type'], "snippet": make_snippet(text, terms),
+                            "score": sum(text.lower().count(t) for t in terms)})
+        results.sort(key=lambda r: -r['score'])
+        return results[:limit]
+
+    def open_sketch(self, name):
+        # Returns the sketch header and an iterator of raw stroke chunks. A sketch
+        # still in the old JSON form is converted to the binary format first, and only
+        # replaced on disk when nothing was lost on the way.
+        path = self.user_dir / name
+        with open(path, 'rb') as f: data = f.read(4)
+        if not sketch.is_binary(data):
+            with open(path, 'rb') as f: content = json.loads(f.read())
+            data = sketch.encode(content)
+            if sketch.lossless(content, data):
+                self.put_file(name, data)
+                self.update(name)
+            f = io.BytesIO(data)
+        else: f = open(path, 'rb')
+        header = sketch.read_header(f)
+        def chunks():
+            with f: yield from sketch.iter_chunks(f, header)
+        return header, chunks()
+
+    def read_sketch(self, name):
+        with profiler.phase('read'), open(self.user_dir / name, 'rb') as f: return decode_sketch(f.read())
+
+    def open_text(self, name):
+        return open(self.user_dir / name, 'r', encoding='utf-8', newline='')
+
+    def upload_path(self, name):
+        return self.staging / (name + '.upload')
+
+    def commit_upload(self, name, path):
+        self.move_in(path, name)
+        fsync_dir(self.user_dir)
+        return self.update(name)
+
+    def write(self, name, content):
+        self.put_file(name, encode_document(name, content))
+        return self.update(name)
+
+    def delete(self, name):
+        if (self.user_dir / name).exists(): self.move_in(None, name)
+        return self.update(name)
+
+def read_chunks(f, size):
+    with f:
+        while True:
+            data = f.read(size)
+            if not data: return
+            yield data
+
+class Upload:
+    # A document arriving from the page in numbered chunks. Each one is appended to a
+    # temp file as it comes in, and the stored document is only replaced once the last
+    # has been written, so a half-finished upload never clobbers anything.
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        # Every upload gets a temp file of its own, even when two of one document overlap.
+        self.path = store.upload_path('%s.%d' % (name, next(UPLOAD_IDS)))
+        self.binary = name.endswith('.sketch')
+        self.seq = 0
+        self.f = None
+        self.error = None
+
+    def write(self, seq, data):
+        if self.error: return
+        try:
+            if seq != self.seq + 1: raise ValueError("chunk %d arrived after %d" % (seq, self.seq))
+            if self.f is None: self.f = open(self.path, 'wb')
+            self.f.write(base64.b64decode(data, validate=True) if self.binary else data.encode('utf-8'))
+            self.seq = seq
+        except (OSError, ValueError) as e: self.error = e
+
+    def commit(self):
+        try:
+            if self.error: raise self.error
+            if self.f is None: self.f = open(self.path, 'wb')
+            with self.f:
+                self.f.flush()
+                os.fsync(self.f.fileno())
+            if self.binary:
+                with open(self.path, 'rb') as f:
+                    if not sketch.is_binary(f.read(4)): raise ValueError("not a sketch")
+            return self.store.commit_upload(self.name, self.path)
+        except (OSError, ValueError) as e:
+            self.error = e
+            self.abort()
+            return None, None
+
+    def abort(self):
+        if self.f: self.f.close()
+        try: os.remove(self.path)
+        except OSError: pass
+
+class SqliteStore:
+    # Optional engine: one SQLite database per user with an FTS5 index over the
+    # searchable text of every document. Presents the same interface as FileStore.
+    watch_dir = None
+
+    def __init__(self, db_path, import_from=None):
+        new = not db_path.exists()
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, type TEXT NOT NULL,
+                content TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, summary TEXT NOT NULL);
+            CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(name, body);
+            CREATE INDEX IF NOT EXISTS docs_mtime ON docs (mtime_ns, name);
+            CREATE INDEX IF NOT EXISTS docs_type ON docs (type, name);
+        """)
+        if new and import_from and import_from.is_dir(): self.import_dir(import_from)
+
+    def entry(self, row):
+        name, ftype, size, mtime_ns, summary = row
+        return {"id": name, "name": name, "type": ftype, "size": size,
+                "mtime": mtime_ns / 1e9, "mtime_ns": mtime_ns, "summary": json.loads(summary)}
+
+    def put(self, name, data, mtime_ns):
+        ftype = file_type(name)
+        try: summary = summarize_data(name, data)
+        except ValueError: summary = {}
+        summary = json.dumps(summary)
+        size = len(data) if isinstance(data, bytes) else len(data.encode('utf-8'))
+        old = self.db.execute("SELECT id FROM docs WHERE name = ?", (name,)).fetchone()
+        if old:
+            self.db.execute("UPDATE docs SET content = ?, size = ?, mtime_ns = ?, summary = ? WHERE id = ?",
+                            (data, size, mtime_ns, summary, old[0]))
+            self.db.execute("DELETE FROM docs_fts WHERE rowid = ?", (old[0],))
+            rowid = old[0]
+        else:
+            rowid = self.db.execute("INSERT INTO docs (name, type, content, size, mtime_ns, summary) VALUES (?, ?, ?, ?, ?, ?)",
+                                    (name, ftype, data, size, mtime_ns, summary)).lastrowid
+        body = ''
+        if ftype in ('diary', 'tasks', 'flashcards'):
+            try: body = searchable_text(ftype, parse_document(name, data))
+            except ValueError: pass
+        self.db.execute("INSERT INTO docs_fts (rowid, name, body) VALUES (?, ?, ?)", (rowid, os.path.splitext(name)[0], body))
+        return ('changed' if old else 'added'), self.entry((name, ftype, size, mtime_ns, summary))
+
+    def import_dir(self, user_dir):
+        # Migrator: pull loose documents from data/<user> into the database. Documents
+        # already in it are left alone, as they may well be newer than the loose copy.
+        imported = 0
+        with self.lock, self.db:
+            existing = {name for name, in self.db.execute("SELECT name FROM docs")}
+            for de in os.scandir(user_dir):
+                if not file_type(de.name) or not de.is_file() or de.name in existing: continue
+                try:
+                    if de.name.endswith('.sketch'):
+                        with open(de.path, 'rb') as f: data = sketch_data(f.read())
+                    else:
+                        with open(de.path, 'r', encoding='utf-8') as f: data = f.read()
+                except (OSError, ValueError): continue
+                self.put(de.name, data, de.stat().st_mtime_ns)
+                imported += 1
+        return imported
+
+    def list(self):
+        with self.lock:
+            return [self.entry(row) for row in self.db.execute("SELECT name, type, size, mtime_ns, summary FROM docs")]
+
+    def page(self, sort, desc, types, limit, cursor=None):
+        cols = SORT_COLUMNS[sort]
+        where, args = [], []
+        if types:
+            where.append("type IN (%s)" % ', '.join('?' * len(types)))
+            args += types
+        with self.lock:
+            total = self.db.execute("SELECT COUNT(*) FROM docs" + (" WHERE " + where[0] if where else ""), args).fetchone()[0]
+            if cursor:
+                where.append("(%s) %s (%s)" % (', '.join(cols), '<' if desc else '>', ', '.join('?' * len(cols))))
+                args += list(decode_cursor(cursor))
+            rows = self.db.execute("SELECT name, type, size, mtime_ns, summary FROM docs%s ORDER BY %s LIMIT ?" % (
+                (" WHERE " + " AND ".join(where)) if where else "", ', '.join(c + (' DESC' if desc else '') for c in cols)),
+                args + [limit + 1]).fetchall()
+        entries = [self.entry(row) for row in rows[:limit]]
+        more = len(rows) > limit
+        return {"entries": entries, "total": total, "next": encode_cursor(SORT_KEYS[sort](entries[-1])) if more and entries else None}
+
+    def scan(self):
+        return [], [], []
+
+    def mark_dirty(self): pass
+
+    def changed_outside(self):
+        return False
+
+    def flush(self): pass
+
+    def revalidate(self, name):
+        return None, self.get(name)
+
+    def get(self, name):
+        with self.lock:
+            row = self.db.execute("SELECT name, type, size, mtime_ns, summary FROM docs WHERE name = ?", (name,)).fetchone()
+        return self.entry(row) if row else None
+
+    def head(self, name, size=4096):
+        with self.lock:
+            row = self.db.execute("SELECT substr(content, 1, ?) FROM docs WHERE name = ?", (size, name)).fetchone()
+        if row is None: raise FileNotFoundError(name)
+        return row[0] if isinstance(row[0], str) else ''
+
+    def read(self, name):
+        with self.lock, profiler.phase('read'):
+            row = self.db.execute("SELECT content FROM docs WHERE name = ?", (name,)).fetchone()
+        if row is None: raise FileNotFoundError(name)
+        return parse_document(name, row[0])
+
+    def open_sketch(self, name):
+        with self.lock:
+            row = self.db.execute("SELECT content FROM docs WHERE name = ?", (name,)).fetchone()
+        if row is None: raise FileNotFoundError(name)
+        f = io.BytesIO(sketch_data(row[0]))
+        header = sketch.read_header(f)
+        return header, sketch.iter_chunks(f, header)
+
+    def read_sketch(self, name):
+        with self.lock, profiler.phase('read'):
+            row = self.db.execute("SELECT content FROM docs WHERE name = ?", (name,)).fetchone()
+        if row is None: raise FileNotFoundError(name)
+        return decode_sketch(row[0])
+
+    def open_text(self, name):
+        with self.lock:
+            row = self.db.execute("SELECT content FROM docs WHERE name = ?", (name,)).fetchone()
+        if row is None: raise FileNotFoundError(name)
+        return io.StringIO(row[0] if isinstance(row[0], str) else row[0].decode('utf-8'))
+
+    def upload_path(self, name):
+        return self.db_path.with_name('.%s-%s.upload' % (self.db_path.stem, name))
+
+    def commit_upload(self, name, path):
+        # The FTS index needs the whole text anyway, so the finished upload is read back in one go.
+        with open(path, 'rb') as f: data = f.read()
+        if not name.endswith('.sketch'): data = data.decode('utf-8')
+        os.remove(path)
+        with self.lock, self.db: return self.put(name, data, time.time_ns())
+
+    def write(self, name, content):
+        data = encode_document(name, content)
+        with self.lock, self.db: return self.put(name, data, time.time_ns())
+
+    def delete(self, name):
+        with self.lock, self.db:
+            row = self.db.execute("SELECT id, name, type, size, mtime_ns, summary FROM docs WHERE name = ?", (name,)).fetchone()
+            if row is None: return None, None
+            self.db.execute("DELETE FROM docs WHERE id = ?", (row[0],))
+            self.db.execute("DELETE FROM docs_fts WHERE rowid = ?", (row[0],))
+        return 'removed', self.entry(row[1:])
+
+    def search(self, query, limit):
+        # Every word is matched as a quoted prefix so user input can't trip FTS5 query syntax.
+        match = ' '.join('"%s"*' % word.replace('"', '""') for word in query.split())
+        if not match: return []
+        with self.lock:
+            rows = self.db.execute("""
+                SELECT d.name, d.type, snippet(docs_fts, 1, ?, ?, '…', 12), bm25(docs_fts)
+                FROM docs_fts JOIN docs d ON d.id = docs_fts.rowid
+                WHERE docs_fts MATCH ? ORDER BY rank LIMIT ?""", (MARK_START, MARK_END, match, limit)).fetchall()
+        return [{"name": name, "type": ftype, "snippet": snippet, "score": -score} for name, ftype, snippet, score in rows]
+
+def migrate(base_dir):
+    for user_dir in sorted(p for p in base_dir.iterdir() if p.is_dir()):
+        count = SqliteStore(base_dir / (user_dir.name + '.sqlite3')).import_dir(user_dir)
+        print("imported %d new documents for %s" % (count, user_dir.name))
+
+def open_store(root_dir, username, engine):
+    # One user's documents: data/<user>.sqlite3 for the SQLite engine (imported from
+    # data/<user> on first use), otherwise the data/<user> folder itself.
+    user_dir = root_dir / "data" / username
+    if engine == 'sqlite': return SqliteStore(root_dir / "data" / (username + '.sqlite3'), import_from=user_dir)
+    user_dir.mkdir(exist_ok=True)
+    return FileStore(user_dir, root_dir / "cache" / username / "index.json")
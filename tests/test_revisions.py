@@ -0,0 +1,95 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from PyQt6.QtCore import QCoreApplication, QEventLoop
+from bridge import Bridge
+from revisions import Revisions, apply_op, json_ops
+from storage import FileStore
+
+app = QCoreApplication.instance() or QCoreApplication([])
+
+def settle(bridge):
+    # Run the event loop until every task the bridge queued has reported back.
+    while bridge.executor.queues: app.processEvents(QEventLoop.ProcessEventsFlag.WaitForMoreEvents)
+
+class RevisionsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.bridges = []
+
+    def tearDown(self):
+        for bridge in self.bridges:
+            bridge.checkpoint_timer.stop()
+            bridge.executor.wait()
+        self.tmp.cleanup()
+
+    def login(self, user):
+        bridge = Bridge(root_dir=self.root, storage='files')
+        self.bridges.append(bridge)
+        bridge.handleLogin(user, 'pw')
+        settle(bridge)
+        return bridge
+
+    def on_disk(self, user, name):
+        return (self.root / 'data' / user / name).read_text()
+
+    def history(self, bridge, name):
+        return [bridge.revisions.checkout(name, r['rev']) for r in bridge.revisions.history(name)]
+
+    def test_crash_before_checkpoint(self):
+        bridge = self.login('ana')
+        bridge.saveFile('Note', 'v1', 'diary')
+        settle(bridge)
+        bridge.saveFile('Note', 'v2', 'diary')
+        settle(bridge)
+        self.assertEqual(self.on_disk('ana', 'Note.md'), 'v1')
+        # The process dies here: no checkpoint, no shutdown.
+        bridge.checkpoint_timer.stop()
+
+        bridge = self.login('ana')
+        loaded = []
+        bridge.fileLoaded.connect(loaded.append)
+        bridge.loadFile('Note.md')
+        settle(bridge)
+        self.assertEqual(json.loads(loaded[0])['content'], 'v2')
+        self.assertEqual(self.on_disk('ana', 'Note.md'), 'v2')
+        bridge.saveFile('Note', 'v3', 'diary')
+        settle(bridge)
+        bridge.shutdown()
+        self.assertEqual(self.on_disk('ana', 'Note.md'), 'v3')
+        self.assertEqual(self.history(bridge, 'Note.md'), ['v1', 'v2', 'v3'])
+
+    def test_switch_user_with_edits_pending(self):
+        bridge = self.login('ana')
+        bridge.saveFile('Note', 'v1', 'diary')
+        settle(bridge)
+        bridge.saveFile('Note', 'v2', 'diary')
+        settle(bridge)
+        bridge.autosave('Note', 'v3', 'diary')
+        bridge.handleLogin('bob', 'pw')
+        settle(bridge)
+        self.assertEqual(bridge.current_user, 'bob')
+        bridge.shutdown()
+        self.assertEqual(self.on_disk('ana', 'Note.md'), 'v3')
+
+    def test_json_edits_compare_types(self):
+        for old, new in (([{"done": 1}], [{"done": True}]), ({"n": 1}, {"n": 1.0}), ([0], [False]), ([1, 2], [True, 2])):
+            ops = json_ops(old, new)
+            self.assertTrue(ops, (old, new))
+            content = json.loads(json.dumps(old))
+            for op in ops: content = apply_op(content, op)
+            self.assertEqual(json.dumps(content), json.dumps(new))
+
+    def test_retyped_value_reaches_disk(self):
+        (self.root / 'u').mkdir()
+        store = FileStore(self.root / 'u', self.root / 'index.json')
+        store.write('todo.json', json.dumps([{"text": "a", "done": 1}]))
+        revisions = Revisions(self.root / 'revs', store)
+        self.assertTrue(revisions.record('todo.json', json.dumps([{"text": "a", "done": True}])))
+        revisions.checkpoint('todo.json')
+        self.assertIs(json.loads((self.root / 'u' / 'todo.json').read_text())[0]['done'], True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import io
+import json
+import tempfile
+import unittest
+from pathlib import Path
+import sketch
+from storage import FileStore
+
+def roundtrip(content):
+    data = sketch.encode(content)
+    return data, sketch.decode(io.BytesIO(data))
+
+class CodecTest(unittest.TestCase):
+    def test_roundtrip(self):
+        content = {"width": 640, "height": 480, "strokes": [
+            {"color": "#6d4c41", "size": 4, "points": [10, 20, 11, 22, 300, -5]},
+            {"color": "#ff000080", "size": 2.5, "points": [0, 0]},
+            {"color": "#000000", "size": 3, "points": [0, 0, 40000, 0]}]}
+        data, decoded = roundtrip(content)
+        self.assertEqual(decoded, content)
+        self.assertTrue(sketch.lossless(content, data))
+
+    def test_legacy_point_forms(self):
+        data, decoded = roundtrip([{"color": "#123456", "size": 3, "points": [[1, 2], [3, 4]]},
+                                   {"color": "#123456", "size": 3, "points": [{"x": 5, "y": 6}]}])
+        self.assertEqual([s['points'] for s in decoded['strokes']], [[1, 2, 3, 4], [5, 6]])
+
+    def test_fractional_points(self):
+        content = {"strokes": [{"color": "#000000", "size": 3, "points": [1.5, 2.25]}]}
+        data, decoded = roundtrip(content)
+        self.assertEqual(decoded['strokes'][0]['points'], [1.5, 2.2])
+        self.assertFalse(sketch.lossless(content, data))
+
+    def test_colors(self):
+        for color, expected in (("#000", "#000000"), ("#abc", "#aabbcc"), ("#f008", "#ff000088"),
+                                ("#6D4C41", "#6d4c41"), ("red", "#ff0000"), ("Navy", "#000080"),
+                                ("transparent", "#00000000")):
+            content = {"strokes": [{"color": color, "size": 3, "points": [0, 0]}]}
+            data, decoded = roundtrip(content)
+            self.assertEqual(decoded['strokes'][0]['color'], expected, color)
+            self.assertTrue(sketch.lossless(content, data), color)
+
+    def test_unknown_color_is_lossy(self):
+        for color in ("rgb(1, 2, 3)", "#12345", "#gggggg", None):
+            content = {"strokes": [{"color": color, "size": 3, "points": [0, 0]}]}
+            data, decoded = roundtrip(content)
+            self.assertEqual(decoded['strokes'][0]['color'], "#000000")
+            self.assertFalse(sketch.lossless(content, data), color)
+
+    def test_extra_fields_are_lossy(self):
+        for content in ({"strokes": [{"color": "#000", "size": 3, "points": [0, 0], "tool": "eraser"}]},
+                        {"strokes": [], "background": "#fff"},
+                        {"strokes": [{"color": "#000", "size": 3, "points": [[0, 0, 0.5]]}]}):
+            self.assertFalse(sketch.lossless(content, sketch.encode(content)), content)
+
+class LegacySketchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = Path(self.tmp.name)
+        (root / 'u').mkdir()
+        self.store = FileStore(root / 'u', root / 'index.json')
+        self.store.scan()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def open(self, name, content):
+        path = self.store.user_dir / name
+        path.write_text(json.dumps(content))
+        header, chunks = self.store.open_sketch(name)
+        list(chunks)
+        return header, path.read_bytes()
+
+    def test_lossless_sketch_is_converted(self):
+        header, stored = self.open('a.sketch', {"strokes": [{"color": "#000", "size": 3, "points": [[1, 2], [3, 4]]}]})
+        self.assertEqual(header['strokes'], 1)
+        self.assertTrue(sketch.is_binary(stored))
+
+    def test_lossy_sketch_is_left_alone(self):
+        content = {"strokes": [{"color": "rebeccapurple", "size": 3, "points": [[1.25, 2], [3, 4]]}]}
+        header, stored = self.open('b.sketch', content)
+        self.assertEqual(header['strokes'], 1)
+        self.assertEqual(json.loads(stored), content)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from PyQt6.QtCore import QCoreApplication, QEventLoop
+from bridge import Bridge
+
+app = QCoreApplication.instance() or QCoreApplication([])
+
+def settle(bridge):
+    while bridge.executor.queues: app.processEvents(QEventLoop.ProcessEventsFlag.WaitForMoreEvents)
+
+class UploadTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.bridge = Bridge(root_dir=self.root, storage='files')
+        self.bridge.handleLogin('ana', 'pw')
+        settle(self.bridge)
+        self.done = []
+        self.bridge.uploadDone.connect(lambda payload: self.done.append(json.loads(payload)))
+
+    def tearDown(self):
+        self.bridge.shutdown()
+        self.tmp.cleanup()
+
+    def test_overlapping_uploads_of_one_document(self):
+        bridge = self.bridge
+        bridge.beginUpload('u1', 'Big', 'diary')
+        bridge.uploadChunk('u1', 1, 'A' * 1000)
+        bridge.uploadChunk('u1', 2, 'A' * 1000)
+        bridge.beginUpload('u2', 'Big', 'diary')
+        bridge.uploadChunk('u2', 1, 'B' * 1000)
+        bridge.uploadChunk('u1', 3, 'A' * 1000)
+        bridge.uploadChunk('u2', 2, 'B' * 1000)
+        bridge.endUpload('u1')
+        bridge.endUpload('u2')
+        settle(bridge)
+        self.assertEqual((self.root / 'data' / 'ana' / 'Big.md').read_text(), 'B' * 2000)
+        self.assertEqual([(d['upload'], d['ok']) for d in self.done], [('u1', False), ('u2', True)])
+        self.assertTrue(self.done[0]['superseded'])
+        self.assertEqual(list((self.root / 'data' / 'ana' / '.grove').glob('*.upload')), [])
+
+if __name__ == '__main__':
+    unittest.main()